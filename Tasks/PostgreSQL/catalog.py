@@ -0,0 +1,77 @@
+'''
+Catalog discovery: which databases exist and which of their tables carry anon masking rules.
+
+Masking rules are security labels of the `anon` provider on table columns
+(SECURITY LABEL FOR anon ON COLUMN ... IS 'MASKED WITH ...'). The result for each
+database is cached together with a catalog version, and reused as long as the
+version has not changed, i.e. no table or security label was created, altered or dropped.
+'''
+
+import json
+import os
+
+CACHE_FILE = 'catalog_cache.json'
+
+DATABASES_QUERY = """
+    SELECT datname FROM pg_database
+    WHERE NOT datistemplate AND datallowconn AND datname NOT IN ('postgres', 'rdsadmin')
+    ORDER BY datname
+"""
+
+# Any DDL on a table or a security label writes a new row version (new xmin) in
+# pg_class or pg_seclabel, and dropping a label changes the count
+CATALOG_VERSION_QUERY = """
+    SELECT concat_ws(':',
+        (SELECT count(*) FROM pg_seclabel WHERE provider = 'anon'),
+        (SELECT max(xmin::text::bigint) FROM pg_seclabel WHERE provider = 'anon'),
+        (SELECT max(xmin::text::bigint) FROM pg_class WHERE relkind IN ('r', 'p'))
+    )
+"""
+
+MASKED_TABLES_QUERY = """
+    SELECT DISTINCT c.oid::regclass::text AS name
+    FROM pg_seclabel sl
+    JOIN pg_class c ON sl.classoid = 'pg_class'::regclass AND sl.objoid = c.oid
+    WHERE sl.provider = 'anon' AND sl.objsubid > 0 AND sl.label ILIKE 'MASKED WITH%'
+      AND c.relkind IN ('r', 'p')
+    ORDER BY name
+"""
+
+
+class CatalogCache:
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        # db -> {"version": str, "tables": [str]}
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, db, version):
+        entry = self.entries.get(db)
+        if entry and entry['version'] == version:
+            return entry['tables']
+        return None
+
+    def put(self, db, version, tables):
+        self.entries[db] = {'version': version, 'tables': list(tables)}
+
+    def save(self):
+        if self.path:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+async def list_databases(conn):
+    return [row['datname'] for row in await conn.fetch(DATABASES_QUERY)]
+
+
+async def list_masked_tables(conn, db, cache: CatalogCache):
+    version = await conn.fetchval(CATALOG_VERSION_QUERY)
+    tables = cache.get(db, version)
+    if tables is None:
+        tables = [row['name'] for row in await conn.fetch(MASKED_TABLES_QUERY)]
+        cache.put(db, version, tables)
+    return tables
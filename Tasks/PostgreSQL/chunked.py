@@ -0,0 +1,163 @@
+'''
+Chunked anonymization of very large tables.
+
+anon.anonymize_table() rewrites a whole table in one statement and one transaction,
+which on the biggest tables holds locks for hours and has to start over after any failure.
+Tables above CHUNK_THRESHOLD bytes are instead split into ranges of their integer primary
+key (or of ctid blocks when there is none), and each range is masked by its own UPDATE
+with the same MASKED WITH rules anon would apply. Ranges run in parallel like any other job,
+each one commits on its own, and finished ranges are checkpointed to STATE_FILE so an
+interrupted run resumes with the ranges that are left. The checkpoints name the instance
+they were made on and are dropped when a run is against any other one, e.g. a fresh restore.
+ctid ranges need PostgreSQL 14 or later, the first with TID range scans; on older servers
+each range would read the whole table, so tables without an integer primary key keep the
+single anon.anonymize_table() call there.
+'''
+
+import json
+import logging
+import math
+import os
+import re
+
+CHUNK_THRESHOLD = 10 * 1024 ** 3
+# Target size of one range, in bytes of the table
+CHUNK_SIZE = 1024 ** 3
+STATE_FILE = 'anonymize_chunks.json'
+
+MASKED_COLUMNS_QUERY = """
+    SELECT quote_ident(a.attname) AS name, sl.label
+    FROM pg_seclabel sl
+    JOIN pg_attribute a ON a.attrelid = sl.objoid AND a.attnum = sl.objsubid
+    WHERE sl.provider = 'anon' AND sl.classoid = 'pg_class'::regclass AND sl.objoid = $1::regclass
+    ORDER BY a.attnum
+"""
+
+INTEGER_PRIMARY_KEY_QUERY = """
+    SELECT quote_ident(a.attname)
+    FROM pg_index i
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+    WHERE i.indrelid = $1::regclass AND i.indisprimary AND i.indnatts = 1
+      AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)
+"""
+
+BLOCKS_QUERY = "SELECT pg_relation_size($1::regclass) / current_setting('block_size')::bigint"
+# PostgreSQL 14 added TID range scans, before it a ctid range is a sequential scan
+TID_RANGE_SCAN_VERSION = 140000
+
+MASKING_RULE = re.compile(r'^\s*MASKED\s+WITH\s+(?:FUNCTION|VALUE)\s+(.+?)\s*$', re.IGNORECASE | re.DOTALL)
+
+
+class Chunk:
+    __slots__ = ('index', 'column', 'lower', 'upper')
+
+    def __init__(self, index, column, lower, upper):
+        self.index = index
+        # Integer primary key column, or None for ctid block ranges
+        self.column = column
+        self.lower = lower
+        self.upper = upper
+
+    def where(self):
+        if self.column is None:
+            return f"ctid >= '({self.lower},0)'::tid AND ctid < '({self.upper},0)'::tid"
+        return f'{self.column} >= {int(self.lower)} AND {self.column} < {int(self.upper)}'
+
+    def __repr__(self):
+        return f'Chunk({self.index}, {self.column or "ctid"} in [{self.lower}, {self.upper}))'
+
+
+class ChunkState:
+    def __init__(self, instance, path=STATE_FILE):
+        # Ranges marked done on one instance say nothing about another, even on the same host
+        self.instance = instance
+        self.path = path
+        # "db.table" -> {"column": str | None, "ranges": [[lower, upper]], "done": [index]}
+        self.tables = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('instance') == instance:
+                self.tables = saved['tables']
+            else:
+                logging.warning(f"Ignoring the checkpoints in {path}: they are of {saved.get('instance')}, not {instance}")
+
+    def chunks(self, db, table):
+        entry = self.tables.get(f'{db}.{table}')
+        if entry is None:
+            return None
+        return [Chunk(i, entry['column'], lower, upper) for i, (lower, upper) in enumerate(entry['ranges'])]
+
+    def pending(self, db, table):
+        done = set(self.tables[f'{db}.{table}']['done'])
+        return [chunk for chunk in self.chunks(db, table) if chunk.index not in done]
+
+    def start(self, db, table, chunks):
+        self.tables[f'{db}.{table}'] = {
+            'column': chunks[0].column if chunks else None,
+            'ranges': [[chunk.lower, chunk.upper] for chunk in chunks],
+            'done': [],
+        }
+        self.save()
+
+    def finish(self, db, table, chunk):
+        # Returns True once every range of the table is done; the table is then
+        # forgotten so that the next run anonymizes it again from scratch
+        key = f'{db}.{table}'
+        entry = self.tables[key]
+        entry['done'].append(chunk.index)
+        finished = len(entry['done']) == len(entry['ranges'])
+        if finished:
+            del self.tables[key]
+        self.save()
+        return finished
+
+    def save(self):
+        if self.path:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'instance': self.instance, 'tables': self.tables}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def split_range(column, lower, upper, count):
+    # [lower, upper) into `count` contiguous ranges
+    step = max(math.ceil((upper - lower) / count), 1)
+    return [
+        Chunk(i, column, start, min(start + step, upper))
+        for i, start in enumerate(range(lower, upper, step))
+    ]
+
+
+async def plan_chunks(conn, table, size, chunk_size=CHUNK_SIZE):
+    count = max(math.ceil(size / chunk_size), 1)
+    column = await conn.fetchval(INTEGER_PRIMARY_KEY_QUERY, table)
+    if column is not None:
+        lower, upper = await conn.fetchrow(f'SELECT min({column}), max({column}) FROM {table}')
+        if lower is None:
+            return []
+        return split_range(column, lower, upper + 1, count)
+    if int(await conn.fetchval("SELECT current_setting('server_version_num')")) < TID_RANGE_SCAN_VERSION:
+        logging.info(f"{table} has no integer primary key and the server has no TID range scans -- not splitting it")
+        return []
+    blocks = await conn.fetchval(BLOCKS_QUERY, table)
+    # Only the blocks the table has now: rows an UPDATE moves past them are already masked
+    return split_range(None, 0, max(blocks, 1), count)
+
+
+async def masking_update(conn, table):
+    assignments = []
+    for row in await conn.fetch(MASKED_COLUMNS_QUERY, table):
+        rule = MASKING_RULE.match(row['label'])
+        if rule:
+            assignments.append(f"{row['name']} = {rule.group(1)}")
+    if not assignments:
+        return None
+    return f'UPDATE {table} SET {", ".join(assignments)}'
+
+
+async def anonymize_chunk(conn, table, chunk, update=None):
+    update = update or await masking_update(conn, table)
+    if update is None:
+        return 'UPDATE 0'
+    return await conn.execute(f'{update} WHERE {chunk.where()}')
@@ -1,69 +1,407 @@
+import argparse
 import asyncio
-from concurrent.futures import ProcessPoolExecutor
-import asyncpg
 import logging
+import itertools
+import time
+from contextlib import nullcontext
+
+from catalog import CACHE_FILE, CatalogCache, list_databases, list_masked_tables
+from chunked import CHUNK_THRESHOLD, STATE_FILE, ChunkState, anonymize_chunk, plan_chunks
+from scheduler import CostModel, HISTORY_FILE, TableJob, format_plan, log_plan, plan
+
+# How many `anon.anonymize_table()` calls run at the same time, across all databases
+CONCURRENCY = 4
+# Database used to list the other databases
+MAINTENANCE_DB = 'postgres'
+
+
+class TableResult:
+    __slots__ = ('db', 'table', 'result', 'error', 'duration', 'chunk')
+
+    def __init__(self, db, table, result=None, error=None, duration=None, chunk=None):
+        self.db = db
+        # None for a database whose tables could not even be discovered
+        self.table = table
+        self.result = result
+        self.error = error
+        self.duration = duration
+        self.chunk = chunk
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        outcome = f'error={self.error!r}' if self.error else f'result={self.result!r}'
+        part = f', {self.chunk}' if self.chunk is not None else ''
+        return f'TableResult({self.db}.{self.table or "*"}{part}, {outcome})'
 
 
 class PSQL:
-    def __init__(self, host, password):
+    def __init__(self, host, password, concurrency=CONCURRENCY, user='your_user', port='your_port', tracer=None):
         self.host = host
         self.password = password
+        self.user = user
+        self.port = port
+        self.concurrency = concurrency
+        # One lazily created pool per database, shared by all of its tables
+        self._pools = {}
+        self._pool_locks = {}
+        # Seconds each pool.acquire() waited for a free connection, per database
+        self.acquire_waits = {}
+        # tracing.Tracer, or None to trace nothing
+        self.tracer = tracer
+
+    def _span(self, name, **args):
+        return self.tracer.span(name, 'psql', **args) if self.tracer else nullcontext()
+
+    def _traced_pool_options(self, db_name):
+        # Every new connection and every query of the pool's connections gets a span (asyncpg 0.30+ for connect=)
+        tracer = self.tracer
+        numbers = itertools.count(1)
+
+        async def connect(*args, **kwargs):
+            import asyncpg
+
+            with tracer.span('asyncpg.connect', 'psql', db=db_name):
+                return await asyncpg.connect(*args, **kwargs)
+
+        async def init(conn):
+            lane = ('conn', id(conn), f'{db_name} connection {next(numbers)}')
+
+            def log_query(query):
+                end = tracer.clock()
+                args = {'db': db_name, 'sql': query.query[:200]}
+                if query.exception is not None:
+                    args['error'] = type(query.exception).__name__
+                tracer.complete('query', 'psql', end - query.elapsed, end, lane=lane, **args)
+
+            conn.add_query_logger(log_query)
+
+        return {'connect': connect, 'init': init}
+
+    async def get_pool(self, db_name):
+        # Imported here, so importing db.py or asking it for --help doesn't pay for asyncpg
+        import asyncpg
+
+        # Creating a pool is awaited, so guard it against two tables of the same database racing
+        lock = self._pool_locks.setdefault(db_name, asyncio.Lock())
+        async with lock:
+            if db_name not in self._pools:
+                self._pools[db_name] = await asyncpg.create_pool(
+                    user=self.user,
+                    password=self.password,
+                    database=db_name,
+                    host=self.host,
+                    port=self.port,
+                    # Never more connections than calls that can be in flight at once
+                    min_size=1,
+                    max_size=self.concurrency,
+                    **(self._traced_pool_options(db_name) if self.tracer else {}),
+                )
+        return self._pools[db_name]
+
+    async def acquire(self, db_name):
+        pool = await self.get_pool(db_name)
+        started = time.perf_counter()
+        with self._span('pool.acquire', db=db_name):
+            conn = await pool.acquire()
+        self.acquire_waits.setdefault(db_name, []).append(time.perf_counter() - started)
+        return pool, conn
+
+    def acquire_wait_stats(self):
+        # Long waits mean the pool is too small for the concurrency, zero waits everywhere mean it could shrink
+        return {
+            db: {'count': len(waits), 'total': sum(waits), 'max': max(waits)}
+            for db, waits in self.acquire_waits.items() if waits
+        }
+
+    async def close(self):
+        pools, self._pools = self._pools, {}
+        await asyncio.gather(*(pool.close() for pool in pools.values()))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
 
     async def anonymize_table(self, table_name: str, db_name: str):
-        conn = await asyncpg.connect(
-            user='your_user',
-            password=self.password,
-            database=db_name,
-            host=self.host,
-            port='your_port'
-        )
-        logging.info(f"Running `anon.anonymize_table()` on {table_name} in {db_name}")
-        result = await conn.fetchval('SELECT anon.anonymize_table($1)', table_name)
-        await conn.close()
-        return result
+        pool, conn = await self.acquire(db_name)
+        try:
+            logging.info(f"Running `anon.anonymize_table()` on {table_name} in {db_name}")
+            return await conn.fetchval('SELECT anon.anonymize_table($1)', table_name)
+        finally:
+            await pool.release(conn)
+
+    async def plan_table_chunks(self, db_name, table_name, size, state: ChunkState):
+        # Resume the ranges left from an interrupted run, or split the table afresh
+        if state.chunks(db_name, table_name) is None:
+            pool, conn = await self.acquire(db_name)
+            try:
+                chunks = await plan_chunks(conn, table_name, size)
+            finally:
+                await pool.release(conn)
+            if not chunks:
+                return []
+            state.start(db_name, table_name, chunks)
+        return state.pending(db_name, table_name)
+
+    async def anonymize_table_chunk(self, table_name: str, db_name: str, chunk):
+        pool, conn = await self.acquire(db_name)
+        try:
+            logging.info(f"Anonymizing {chunk} of {table_name} in {db_name}")
+            return await anonymize_chunk(conn, table_name, chunk)
+        finally:
+            await pool.release(conn)
+
+    async def _run_table(self, db, table, chunk=None):
+        started = time.perf_counter()
+        try:
+            with self._span('anonymize', db=db, table=table, chunk=str(chunk) if chunk is not None else None):
+                if chunk is None:
+                    result = await self.anonymize_table(table, db)
+                else:
+                    result = await self.anonymize_table_chunk(table, db, chunk)
+            return TableResult(db, table, result=result, duration=time.perf_counter() - started, chunk=chunk)
+        except Exception as e:
+            part = f"{chunk} of " if chunk is not None else ""
+            logging.error(f"Failed to anonymize {part}{table} in {db}: {e}")
+            return TableResult(db, table, error=e, duration=time.perf_counter() - started, chunk=chunk)
 
     async def anonymize_tables(self, table_info: list):
-        loop = asyncio.get_running_loop()
-        with ProcessPoolExecutor(max_workers=4) as executor:
-            futures = [
-                loop.run_in_executor(executor, self.anonymize_table, table, db)
-                for db, table in table_info
-            ]
-            results = await asyncio.gather(*futures)
+        # The work runs on the database server, so plain tasks are enough: the semaphore
+        # keeps exactly `concurrency` anonymize_table() calls in flight until the list runs out
+        limit = asyncio.Semaphore(self.concurrency)
+        busy = 0
+
+        # Semaphore waiters are woken in FIFO order, so tables start in the order of table_info
+        async def run(db, table):
+            nonlocal busy
+            with self._span('wait for worker', db=db, table=table):
+                await limit.acquire()
+            try:
+                busy += 1
+                if self.tracer:
+                    self.tracer.counter('workers', busy=busy, idle=self.concurrency - busy)
+                return await self._run_table(db, table)
+            finally:
+                busy -= 1
+                limit.release()
+                if self.tracer:
+                    self.tracer.counter('workers', busy=busy, idle=self.concurrency - busy)
+
+        return await asyncio.gather(*(run(db, table) for db, table in table_info))
+
+    async def get_table_sizes(self, db_name, tables):
+        # Size on disk including indexes and TOAST, plus the planner's row estimate
+        pool, conn = await self.acquire(db_name)
+        try:
+            rows = await conn.fetch(
+                """
+                SELECT t.name, pg_total_relation_size(c.oid) AS size, greatest(c.reltuples, 0)::bigint AS rows
+                FROM unnest($1::text[]) AS t(name)
+                JOIN pg_class c ON c.oid = t.name::regclass
+                """,
+                list(tables),
+            )
+        finally:
+            await pool.release(conn)
+        return {row['name']: (row['size'], row['rows']) for row in rows}
+
+    async def plan_tables(self, table_info: list, cost_model: CostModel):
+        by_db = {}
+        for db, table in table_info:
+            by_db.setdefault(db, []).append(table)
+        dbs = list(by_db)
+        sizes = await asyncio.gather(*(self.get_table_sizes(db, by_db[db]) for db in dbs))
+        jobs = []
+        for db, db_sizes in zip(dbs, sizes):
+            for table in by_db[db]:
+                size, rows = db_sizes.get(table, (0, 0))
+                jobs.append(TableJob(db, table, size, rows, cost_model.estimate(db, table, size)))
+        return plan(jobs, self.concurrency)
+
+    async def anonymize_planned(self, table_info: list, history_file=HISTORY_FILE, dry_run=False):
+        # Longest tables first across all databases, so the biggest one never starts last
+        cost_model = CostModel(history_file)
+        ordered, makespan, slots = await self.plan_tables(table_info, cost_model)
+        if dry_run:
+            print(format_plan(ordered, makespan, slots))
+            return []
+        log_plan(ordered, makespan, slots)
+        results = await self.anonymize_tables([(job.db, job.table) for job in ordered])
+        for job, result in zip(ordered, results):
+            if result.ok:
+                cost_model.record(job.db, job.table, job.size, result.duration)
+        cost_model.save()
         return results
 
-    def get_dbs(self):
+    async def instance_id(self):
+        # The server the chunk checkpoints belong to. A fresh restore, even under the same
+        # host name, starts a new postmaster; so does a restart, which only costs a fresh start
+        async with (await self.get_pool(MAINTENANCE_DB)).acquire() as conn:
+            started = await conn.fetchval('SELECT pg_postmaster_start_time()')
+        return f'{self.host}:{self.port} started {started.isoformat()}'
+
+    async def get_dbs(self):
         # Retrieve a list of databases
-        pass
+        async with (await self.get_pool(MAINTENANCE_DB)).acquire() as conn:
+            return await list_databases(conn)
+
+    async def get_tables_for_db(self, db, cache: CatalogCache = None):
+        # Retrieve the tables with anon masking rules in a specific database,
+        # from the cache when the database's catalog has not changed since
+        cache = cache if cache is not None else CatalogCache(None)
+        pool, conn = await self.acquire(db)
+        try:
+            return await list_masked_tables(conn, db, cache)
+        finally:
+            await pool.release(conn)
+
+    async def install_anonymizer(self, db):
+        # Install the anonymizer in a specific database
+        pool, conn = await self.acquire(db)
+        try:
+            await conn.execute('CREATE EXTENSION IF NOT EXISTS anon CASCADE')
+            if not await conn.fetchval('SELECT anon.is_initialized()'):
+                await conn.execute('SELECT anon.init()')
+        finally:
+            await pool.release(conn)
+
+    async def discover(self, on_database, cache: CatalogCache, install=True):
+        # All databases are discovered at the same time, and each one is handed to
+        # on_database(db, tables) as soon as it is ready rather than after all of them.
+        # Returns {db: error} for the databases whose tables could not be discovered
+        errors = {}
+
+        async def discover_db(db):
+            try:
+                if install:
+                    await self.install_anonymizer(db)
+                tables = await self.get_tables_for_db(db, cache)
+            except Exception as e:
+                logging.error(f"Failed to discover tables in {db}: {e}")
+                errors[db] = e
+                return
+            logging.info(f"Discovered {len(tables)} tables to anonymize in {db}")
+            try:
+                await on_database(db, tables)
+            except Exception as e:
+                logging.error(f"Failed to handle the tables of {db}: {e}")
+
+        await asyncio.gather(*(discover_db(db) for db in await self.get_dbs()))
+        cache.save()
+        return errors
+
+    async def anonymize_streamed(self, history_file=HISTORY_FILE, cache_file=CACHE_FILE,
+                                 chunk_threshold=CHUNK_THRESHOLD, state_file=STATE_FILE, instance=None):
+        # Workers start on a database's tables while the others are still being discovered,
+        # always taking the longest table known so far. Tables above chunk_threshold bytes
+        # are queued as ranges that run in parallel and are checkpointed to state_file, for
+        # `instance` (by default instance_id()); checkpoints of any other instance are ignored
+        cost_model = CostModel(history_file)
+        chunk_state = ChunkState(instance or await self.instance_id(), state_file)
+        queue = asyncio.PriorityQueue()
+        order = itertools.count()
+        results = []
+        chunk_durations = {}
+
+        async def enqueue(db, tables):
+            # All of a database's jobs are planned before any is queued, so when planning fails
+            # every table of it is reported as failed, rather than some run and the rest skipped
+            jobs = []
+            try:
+                sizes = await self.get_table_sizes(db, tables)
+                for table in tables:
+                    size, rows = sizes.get(table, (0, 0))
+                    estimate = cost_model.estimate(db, table, size)
+                    chunks = await self.plan_table_chunks(db, table, size, chunk_state) if size >= chunk_threshold else []
+                    if not chunks:
+                        jobs.append(TableJob(db, table, size, rows, estimate))
+                    else:
+                        jobs.extend(
+                            TableJob(db, table, size, rows, estimate / len(chunk_state.chunks(db, table)), chunk)
+                            for chunk in chunks
+                        )
+            except Exception as e:
+                results.extend(TableResult(db, table, error=e) for table in tables)
+                raise
+            for job in jobs:
+                queue.put_nowait((-job.estimate, next(order), job))
+            if self.tracer:
+                self.tracer.counter('queue', depth=queue.qsize())
+
+        async def feed():
+            try:
+                errors = await self.discover(enqueue, CatalogCache(cache_file))
+                # A database left out entirely fails the run like a table that failed
+                results.extend(TableResult(db, None, error=e) for db, e in errors.items())
+            finally:
+                # One stop marker per worker, sorted after every real job
+                for _ in range(self.concurrency):
+                    queue.put_nowait((float('inf'), next(order), None))
+
+        busy = 0
+
+        async def worker():
+            nonlocal busy
+            while (job := (await queue.get())[2]) is not None:
+                busy += 1
+                if self.tracer:
+                    self.tracer.counter('queue', depth=queue.qsize())
+                    self.tracer.counter('workers', busy=busy, idle=self.concurrency - busy)
+                result = await self._run_table(job.db, job.table, job.chunk)
+                busy -= 1
+                if self.tracer:
+                    self.tracer.counter('workers', busy=busy, idle=self.concurrency - busy)
+                if result.ok and job.chunk is None:
+                    cost_model.record(job.db, job.table, job.size, result.duration)
+                elif result.ok:
+                    key = (job.db, job.table)
+                    chunk_durations[key] = chunk_durations.get(key, 0.0) + result.duration
+                    if chunk_state.finish(job.db, job.table, job.chunk):
+                        # Total work over all ranges, comparable with a single-call duration
+                        cost_model.record(job.db, job.table, job.size, chunk_durations.pop(key))
+                results.append(result)
+
+        await asyncio.gather(feed(), *(worker() for _ in range(self.concurrency)))
+        cost_model.save()
+        return results
 
-    def get_tables_for_db(self, db):
-        # Retrieve a list of tables for a specific database
-        pass
+    async def anonymize_database(self, host, history_file=HISTORY_FILE, dry_run=False, cache_file=CACHE_FILE):
+        async with PSQL(host, 'your_password', self.concurrency, self.user, self.port) as psql:  # Replace with actual password retrieval
+            if dry_run:
+                table_info = []
 
-    async def anonymize_database(self, host):
-        psql = PSQL(host, 'your_password')  # Replace with actual password retrieval
-        databases = psql.get_dbs()
+                async def collect(db, tables):
+                    table_info.extend((db, table) for table in tables)
 
-        table_info = []
-        for db in databases:
-            tables = psql.get_tables_for_db(db)
-            for table in tables:
-                table_info.append((db, table))
+                await psql.discover(collect, CatalogCache(cache_file), install=False)
+                return await psql.anonymize_planned(table_info, history_file, dry_run=True)
 
-        # Anonymize tables in parallel, using up to 4 processes
-        results = await psql.anonymize_tables(table_info)
+            # Anonymize tables in parallel, `concurrency` at a time across all databases, longest first
+            results = await psql.anonymize_streamed(history_file, cache_file)
+            logging.info(f"Connection acquire waits: {psql.acquire_wait_stats()}")
         return results
 
 
 # Define the main asynchronous function to run the anonymization process.
-async def main():
+async def main(args):
     host = 'your_host'  # Replace with the actual database host.
-    psql = PSQL(host, 'your_password')  # Replace with the actual password.
+    psql = PSQL(host, 'your_password', args.concurrency)  # Replace with the actual password.
 
     # Call the anonymize_database method and print the results.
-    results = await psql.anonymize_database(host)
-    print(results)
+    results = await psql.anonymize_database(host, args.history_file, args.plan, args.cache_file)
+    if not args.plan:
+        print(results)
 
 
 # Run the main asynchronous function.
-asyncio.run(main())
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Anonymize all tables of all databases in parallel')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='anonymize_table() calls in flight at once')
+    parser.add_argument('--history-file', default=HISTORY_FILE, help='durations of previous runs used to plan this one')
+    parser.add_argument('--cache-file', default=CACHE_FILE, help='discovered tables, reused while the catalog is unchanged')
+    parser.add_argument('--plan', action='store_true', help='only print the planned schedule and expected makespan')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,101 @@
+'''
+Longest-job-first ordering of anon.anonymize_table() calls.
+
+With a fixed number of workers the run takes as long as the busiest worker. If a 200 GB
+table starts last, every other worker sits idle while it finishes. Starting the most
+expensive tables first (LPT scheduling) keeps the makespan within 4/3 of the optimum.
+The cost of a table is the measured duration from a previous run when there is one,
+otherwise its size divided by the throughput observed so far.
+'''
+
+import heapq
+import json
+import logging
+import os
+
+HISTORY_FILE = 'anonymize_history.json'
+# Assumed throughput before any run has been measured, in bytes per second
+DEFAULT_BYTES_PER_SECOND = 50 * 1024 * 1024
+
+
+class TableJob:
+    __slots__ = ('db', 'table', 'size', 'rows', 'estimate', 'chunk')
+
+    def __init__(self, db, table, size=0, rows=0, estimate=0.0, chunk=None):
+        self.db = db
+        self.table = table
+        self.size = size
+        self.rows = rows
+        self.estimate = estimate
+        # A range of a chunked table, or None for the whole table
+        self.chunk = chunk
+
+    def __repr__(self):
+        part = f', {self.chunk}' if self.chunk is not None else ''
+        return f'TableJob({self.db}.{self.table}{part}, size={self.size}, estimate={self.estimate:.1f}s)'
+
+
+class CostModel:
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        # "db.table" -> {"size": bytes, "duration": seconds} of the last successful run
+        self.history = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.history = json.load(f)
+
+    def bytes_per_second(self):
+        measured = [h for h in self.history.values() if h['duration'] > 0 and h['size'] > 0]
+        if not measured:
+            return DEFAULT_BYTES_PER_SECOND
+        return sum(h['size'] for h in measured) / sum(h['duration'] for h in measured)
+
+    def estimate(self, db, table, size):
+        previous = self.history.get(f'{db}.{table}')
+        if previous and previous['size'] > 0:
+            # Scale the last duration in case the table grew or shrank since
+            return previous['duration'] * size / previous['size']
+        if previous:
+            return previous['duration']
+        return size / self.bytes_per_second()
+
+    def record(self, db, table, size, duration):
+        self.history[f'{db}.{table}'] = {'size': size, 'duration': duration}
+
+    def save(self):
+        if self.path:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.history, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def plan(jobs, workers):
+    '''
+    Orders jobs longest-first and simulates them on `workers` workers.
+    Returns the ordered jobs, the expected makespan and each job's (worker, start) slot.
+    '''
+    ordered = sorted(jobs, key=lambda job: job.estimate, reverse=True)
+    free_at = [(0.0, worker) for worker in range(workers)]
+    slots = []
+    makespan = 0.0
+    for job in ordered:
+        start, worker = heapq.heappop(free_at)
+        slots.append((worker, start))
+        makespan = max(makespan, start + job.estimate)
+        heapq.heappush(free_at, (start + job.estimate, worker))
+    return ordered, makespan, slots
+
+
+def format_plan(ordered, makespan, slots):
+    lines = [f'{"worker":>6} {"start":>10} {"estimate":>10} {"size":>12}  table']
+    for job, (worker, start) in zip(ordered, slots):
+        lines.append(f'{worker:>6} {start:>9.1f}s {job.estimate:>9.1f}s {job.size:>12}  {job.db}.{job.table}')
+    lines.append(f'Expected makespan: {makespan:.1f}s')
+    return '\n'.join(lines)
+
+
+def log_plan(ordered, makespan, slots):
+    logging.info(f"Planned {len(ordered)} tables, expected makespan {makespan:.1f}s")
+    for job, (worker, start) in zip(ordered, slots):
+        logging.debug(f"worker {worker} at {start:.1f}s: {job}")
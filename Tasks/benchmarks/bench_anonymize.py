@@ -0,0 +1,128 @@
+# bench_anonymize.py
+'''
+PSQL.anonymize_tables() against a local Postgres with a fake anonymizer.
+
+Creates `databases` databases with `tables` tables each, of sizes drawn from a skewed
+distribution (a few big tables, many small ones, like the real services). The fake
+anon.anonymize_table() sleeps `seconds_per_mb` per MB of pg_total_relation_size, so the
+server side costs what it would in proportion, without the anon extension. Reports the
+makespan against the ideal one for the concurrency, and the connection acquire waits.
+
+Needs a Postgres where the user may create databases, e.g.
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=bench postgres
+'''
+
+import asyncio
+import random
+
+import asyncpg
+
+from harness import use_tasks
+
+use_tasks()
+
+from db import CONCURRENCY, MAINTENANCE_DB, PSQL
+
+DATABASE_PREFIX = 'bench_anon_'
+
+FAKE_ANONYMIZER = '''
+CREATE SCHEMA IF NOT EXISTS anon;
+CREATE OR REPLACE FUNCTION anon.anonymize_table(table_name text) RETURNS boolean AS $$
+BEGIN
+    PERFORM pg_sleep(pg_total_relation_size(table_name::regclass) / 1048576.0 * {seconds_per_mb});
+    RETURN true;
+END
+$$ LANGUAGE plpgsql;
+'''
+
+
+def table_rows(count, mean_rows, rng):
+    # Pareto-like: most tables are small, a few dominate the total
+    return [max(1, int(mean_rows * rng.paretovariate(1.5) / 3)) for _ in range(count)]
+
+
+async def setup(options, rng):
+    connect = dict(host=options.host, port=options.port, user=options.user, password=options.password)
+    admin = await asyncpg.connect(database=MAINTENANCE_DB, **connect)
+    table_info = []
+    try:
+        for index in range(options.databases):
+            db = f'{DATABASE_PREFIX}{index}'
+            await admin.execute(f'DROP DATABASE IF EXISTS {db}')
+            await admin.execute(f'CREATE DATABASE {db}')
+            conn = await asyncpg.connect(database=db, **connect)
+            try:
+                await conn.execute(FAKE_ANONYMIZER.format(seconds_per_mb=options.seconds_per_mb))
+                for number, rows in enumerate(table_rows(options.tables, options.mean_rows, rng)):
+                    table = f'table_{number}'
+                    await conn.execute(
+                        f'CREATE TABLE {table} AS SELECT g AS id, md5(g::text) AS payload FROM generate_series(1, {rows}) g'
+                    )
+                    size = await conn.fetchval('SELECT pg_total_relation_size($1::regclass)', table)
+                    table_info.append((db, table, size))
+            finally:
+                await conn.close()
+    finally:
+        await admin.close()
+    return table_info
+
+
+async def teardown(options):
+    admin = await asyncpg.connect(database=MAINTENANCE_DB, host=options.host, port=options.port,
+                                  user=options.user, password=options.password)
+    try:
+        for index in range(options.databases):
+            await admin.execute(f'DROP DATABASE IF EXISTS {DATABASE_PREFIX}{index}')
+    finally:
+        await admin.close()
+
+
+async def bench(options):
+    rng = random.Random(options.seed)
+    tables = await setup(options, rng)
+    # Discovery order, not the size order, as anonymize_tables() gets it today
+    rng.shuffle(tables)
+    try:
+        async with PSQL(options.host, options.password, options.concurrency, options.user, options.port, options.tracer) as psql:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            results = await psql.anonymize_tables([(db, table) for db, table, _ in tables])
+            makespan = loop.time() - started
+            waits = [wait for per_db in psql.acquire_waits.values() for wait in per_db]
+    finally:
+        if not options.keep:
+            await teardown(options)
+
+    seconds = [size / 2 ** 20 * options.seconds_per_mb for _, _, size in tables]
+    ideal = max(sum(seconds) / options.concurrency, max(seconds))
+    total_bytes = sum(size for _, _, size in tables)
+    return {
+        'tables': len(tables),
+        'failed': sum(not result.ok for result in results),
+        'total_mb': total_bytes / 2 ** 20,
+        'makespan_seconds': makespan,
+        'ideal_makespan_seconds': ideal,
+        'efficiency': ideal / makespan if makespan else 0.0,
+        'tables_per_second': len(tables) / makespan if makespan else 0.0,
+        'mb_per_second': total_bytes / 2 ** 20 / makespan if makespan else 0.0,
+        'acquire_wait_max_seconds': max(waits, default=0.0),
+        'acquire_wait_total_seconds': sum(waits),
+    }
+
+
+def run(options):
+    return asyncio.run(bench(options))
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group('anonymize')
+    group.add_argument('--pg-host', dest='host', default='localhost')
+    group.add_argument('--pg-port', dest='port', type=int, default=5432)
+    group.add_argument('--pg-user', dest='user', default='postgres')
+    group.add_argument('--pg-password', dest='password', default='bench')
+    group.add_argument('--databases', type=int, default=3)
+    group.add_argument('--tables', type=int, default=20, help='tables per database')
+    group.add_argument('--mean-rows', type=int, default=20000)
+    group.add_argument('--seconds-per-mb', type=float, default=0.5, help='cost of the fake anon.anonymize_table()')
+    group.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    group.add_argument('--keep', action='store_true', help='keep the benchmark databases afterwards')
@@ -0,0 +1,136 @@
+# bench_monitoring.py
+'''
+The site checker (monitoring.Prober) against a local farm of fake websites.
+
+The farm listens on `hosts` ports, so the per-host connection limit applies as it would
+across real sites, each serving `sites_per_host` paths. A request takes `latency` seconds
+(+- `jitter`), fails with a 500 at `failure_rate`, and hangs past the probe timeout at
+`hang_rate`. The farm runs its own event loop in a thread, so the probes don't compete
+with it for the same loop. Reports the time per round of probing every site, probes per
+second, the latency quantiles seen by the prober and the requests the farm served.
+'''
+
+import asyncio
+import random
+import threading
+
+from aiohttp import web
+
+from harness import use_tasks
+
+use_tasks()
+
+from monitoring import MAX_CONCURRENCY, PER_HOST_CONCURRENCY, Metrics, Prober
+
+BASE_PORT = 18080
+
+
+class SiteFarm:
+    def __init__(self, hosts, latency, jitter, failure_rate, hang_rate, hang_seconds, seed=None):
+        self.hosts = hosts
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self._loop = None
+        self._stopped = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    async def handle(self, request):
+        self.requests += 1
+        roll = self.rng.random()
+        if roll < self.hang_rate:
+            await asyncio.sleep(self.hang_seconds)
+        await asyncio.sleep(self.latency * self.rng.uniform(1 - self.jitter, 1 + self.jitter))
+        if roll < self.hang_rate + self.failure_rate:
+            return web.Response(status=500)
+        return web.Response(text='ok')
+
+    async def _serve(self):
+        app = web.Application()
+        app.router.add_get('/{site}', self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        for port in range(BASE_PORT, BASE_PORT + self.hosts):
+            await web.TCPSite(runner, '127.0.0.1', port).start()
+        self._stopped = asyncio.Event()
+        self._ready.set()
+        await self._stopped.wait()
+        await runner.cleanup()
+
+    def __enter__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self._serve(),), daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def __exit__(self, *exc):
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join()
+        self._loop.close()
+
+    def urls(self, sites_per_host):
+        return [
+            f'http://127.0.0.1:{port}/site-{site}'
+            for port in range(BASE_PORT, BASE_PORT + self.hosts)
+            for site in range(sites_per_host)
+        ]
+
+
+async def bench(options, urls):
+    metrics = Metrics()
+    rounds = []
+    failed = 0
+    loop = asyncio.get_running_loop()
+    async with Prober(options.max_concurrency, options.per_host, options.probe_timeout, options.tracer) as prober:
+        for _ in range(options.rounds):
+            started = loop.time()
+            results = await prober.probe_all(urls)
+            rounds.append(loop.time() - started)
+            for result in results.values():
+                metrics.observe(result)
+                failed += not result.ok
+    return metrics, rounds, failed
+
+
+def run(options):
+    farm = SiteFarm(options.hosts, options.latency, options.jitter, options.failure_rate,
+                    options.hang_rate, options.probe_timeout * 2, options.seed)
+    with farm:
+        urls = farm.urls(options.sites_per_host)
+        metrics, rounds, failed = asyncio.run(bench(options, urls))
+
+    summary = metrics.summary().values()
+    probes = len(urls) * len(rounds)
+    p50 = sorted(site['p50'] for site in summary if site['p50'] is not None)
+    p99 = sorted(site['p99'] for site in summary if site['p99'] is not None)
+    return {
+        'sites': len(urls),
+        'probes': probes,
+        'round_seconds_mean': sum(rounds) / len(rounds),
+        'round_seconds_max': max(rounds),
+        'probes_per_second': probes / sum(rounds),
+        'failed': failed,
+        'latency_p50_median_seconds': p50[len(p50) // 2] if p50 else 0.0,
+        'latency_p99_max_seconds': p99[-1] if p99 else 0.0,
+        'farm_requests': farm.requests,
+    }
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group('monitoring')
+    group.add_argument('--hosts', type=int, default=20, help='fake websites listening on their own port')
+    group.add_argument('--sites-per-host', type=int, default=25)
+    group.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    group.add_argument('--jitter', type=float, default=0.5, help='+- fraction of the latency')
+    group.add_argument('--failure-rate', type=float, default=0.05, help='fraction of requests answered with 500')
+    group.add_argument('--hang-rate', type=float, default=0.01, help='fraction of requests that outlast the timeout')
+    group.add_argument('--probe-timeout', type=float, default=1.0)
+    group.add_argument('--max-concurrency', type=int, default=MAX_CONCURRENCY)
+    group.add_argument('--per-host', type=int, default=PER_HOST_CONCURRENCY)
+    group.add_argument('--rounds', type=int, default=3, help='times every site is probed')
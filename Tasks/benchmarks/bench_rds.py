@@ -0,0 +1,115 @@
+# bench_rds.py
+'''
+RDS.restore_instance_from_shared() against moto.
+
+Restores `restores` targets from one shared snapshot, the way a night of restores does,
+and counts the RDS API calls made per operation. moto finishes copies and restores at
+once, so the numbers show the client-side cost: API calls (what runs into throttling) and
+overhead, not the time AWS takes.
+
+moto cannot share snapshots across accounts, so the source is a manual snapshot named
+SHARED_PREFIX...; botocore event hooks list it for SnapshotType='shared' and hide it from
+the manual listings, which a real shared snapshot is not part of.
+'''
+
+import os
+import time
+from collections import Counter
+
+import boto3
+from moto import mock_aws
+
+from harness import use_tasks
+
+use_tasks()
+
+from rds_new import RDS
+from tracing import instrument_boto
+
+REGION = 'eu-central-1'
+SHARED_PREFIX = 'bench-shared-'
+SOURCE = 'bench-source'
+CONFIG_FROM = 'bench-config'
+
+
+def emulate_sharing(client):
+    def before_parameters(params, context, **kwargs):
+        context['bench_shared'] = params.get('SnapshotType') == 'shared'
+        if context['bench_shared']:
+            params['SnapshotType'] = 'manual'
+            params.pop('IncludeShared', None)
+
+    def after_call(parsed, context, **kwargs):
+        if 'DBSnapshots' not in parsed or 'bench_shared' not in context:
+            return
+        shared = context['bench_shared']
+        parsed['DBSnapshots'] = [
+            s for s in parsed['DBSnapshots'] if s['DBSnapshotIdentifier'].startswith(SHARED_PREFIX) == shared
+        ]
+
+    client.meta.events.register('before-parameter-build.rds.DescribeDBSnapshots', before_parameters)
+    client.meta.events.register('after-call.rds.DescribeDBSnapshots', after_call)
+
+
+def count_calls(client):
+    calls = Counter()
+
+    def before_call(model, **kwargs):
+        calls[model.name] += 1
+
+    client.meta.events.register('before-call.rds', before_call)
+    return calls
+
+
+def setup(session, rds_client):
+    ec2 = session.client('ec2')
+    vpc = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+    subnet = ec2.create_subnet(VpcId=vpc, CidrBlock='10.0.0.0/24')['Subnet']['SubnetId']
+    rds_client.create_db_subnet_group(DBSubnetGroupName='bench', DBSubnetGroupDescription='bench', SubnetIds=[subnet])
+    kms = session.client('kms')
+    kms.create_alias(AliasName='alias/shared_kms', TargetKeyId=kms.create_key()['KeyMetadata']['KeyId'])
+    for identifier in (SOURCE, CONFIG_FROM):
+        rds_client.create_db_instance(
+            DBInstanceIdentifier=identifier, DBInstanceClass='db.t3.micro', Engine='postgres',
+            AllocatedStorage=20, MasterUsername='bench', MasterUserPassword='benchpassword',
+            DBSubnetGroupName='bench',
+        )
+    rds_client.create_db_snapshot(DBSnapshotIdentifier=f'{SHARED_PREFIX}1', DBInstanceIdentifier=SOURCE)
+
+
+def run(options):
+    # moto must never reach a real account
+    os.environ.update(AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing', AWS_DEFAULT_REGION=REGION)
+    os.environ.pop('AWS_PROFILE', None)
+    with mock_aws():
+        rds = RDS(tracer=options.tracer)
+        setup(boto3.session.Session(region_name=REGION), rds.rds_client)
+        emulate_sharing(rds.rds_client)
+        calls = count_calls(rds.rds_client)
+        if options.tracer is not None:
+            instrument_boto(rds.rds_client, options.tracer)
+
+        durations = []
+        for number in range(options.restores):
+            started = time.perf_counter()
+            rds.restore_instance_from_shared(SOURCE, f'bench-target-{number}', CONFIG_FROM)
+            durations.append(time.perf_counter() - started)
+        restore_calls = Counter(calls)
+        for number in range(options.restores):
+            rds.destroy_instance(f'bench-target-{number}')
+
+    return {
+        'restores': options.restores,
+        'makespan_seconds': sum(durations),
+        'first_restore_seconds': durations[0] if durations else 0.0,
+        'restores_per_second': len(durations) / sum(durations) if durations else 0.0,
+        'api_calls': sum(restore_calls.values()),
+        'api_calls_per_restore': sum(restore_calls.values()) / len(durations) if durations else 0.0,
+        'inventory_api_calls': rds.inventory.api_calls,
+        **{f'api_calls.{operation}': count for operation, count in sorted(restore_calls.items())},
+    }
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group('rds')
+    group.add_argument('--restores', type=int, default=10, help='targets restored from the same shared snapshot')
@@ -0,0 +1,97 @@
+# bench_startup.py
+'''
+Start-up time of the task entry points and modules, each in a fresh interpreter.
+
+Entry points are run with --help, which parses the command line and exits, so it is the
+floor of every cron invocation; modules are imported the way other code reuses them.
+The first run of each is reported as the cold start (bytecode and files not yet cached),
+the median of the rest as the warm one. Both are compared with STARTUP_TARGET. With
+--startup-profile the slowest imports of each are printed from `python -X importtime`.
+'''
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from harness import TASKS
+
+# Cold start budget for a short cron run; the interpreter alone takes about 20 ms
+STARTUP_TARGET = 0.25
+
+ENTRY_POINTS = {
+    'monitoring.py': ('.', ['monitoring.py', '--help']),
+    'pipeline.py': ('.', ['pipeline.py', '--help']),
+    'db.py': ('PostgreSQL', ['db.py', '--help']),
+    'rds_snapshot/main.py': ('rds_snapshot', ['main.py', '--help']),
+}
+MODULES = {
+    'import monitoring': ('.', 'monitoring'),
+    'import db': ('PostgreSQL', 'db'),
+    'import db_class': ('PostgreSQL', 'db_class'),
+    'import rds_new': ('rds_snapshot', 'rds_new'),
+    'import orchestrator': ('rds_snapshot', 'orchestrator'),
+    'import aio': ('rds_snapshot', 'aio'),
+}
+
+
+def command(spec, module):
+    directory, target = spec
+    if module:
+        return directory, [sys.executable, '-c', f'import {target}']
+    return directory, [sys.executable, *target]
+
+
+def timed(directory, args, runs):
+    seconds = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        completed = subprocess.run(args, cwd=os.path.join(TASKS, directory), capture_output=True)
+        seconds.append(time.perf_counter() - started)
+        if completed.returncode:
+            raise RuntimeError(f"{' '.join(args[1:])} failed: {completed.stderr.decode().strip().splitlines()[-1]}")
+    return seconds
+
+
+def slowest_imports(directory, args, count=5):
+    # -X importtime writes "self | cumulative | module" per import to stderr
+    completed = subprocess.run([args[0], '-X', 'importtime', *args[1:]], cwd=os.path.join(TASKS, directory),
+                               capture_output=True, text=True)
+    rows = []
+    for line in completed.stderr.splitlines():
+        parts = line.removeprefix('import time:').split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            # One space after the bar, more for imports nested in another one
+            rows.append((int(parts[1]), parts[2][1:]))
+    # Only top-level imports, their cumulative time includes everything below them
+    top = sorted((row for row in rows if not row[1].startswith(' ')), reverse=True)[:count]
+    return ', '.join(f'{name} {micros / 1000:.0f} ms' for micros, name in top)
+
+
+def run(options):
+    metrics = {}
+    over = 0
+    for name, spec, module in [(n, s, False) for n, s in ENTRY_POINTS.items()] + [(n, s, True) for n, s in MODULES.items()]:
+        directory, args = command(spec, module)
+        try:
+            seconds = timed(directory, args, options.startup_runs)
+        except RuntimeError as e:
+            # e.g. a dependency that is imported eagerly and not installed here
+            print(f'{name}: {e}', file=sys.stderr)
+            continue
+        metrics[f'{name}.cold_seconds'] = seconds[0]
+        metrics[f'{name}.warm_seconds'] = statistics.median(seconds[1:] or seconds)
+        over += seconds[0] > options.startup_target
+        if options.startup_profile:
+            print(f'{name}: {slowest_imports(directory, args)}', file=sys.stderr)
+    metrics['over_target'] = over
+    metrics['target_seconds'] = options.startup_target
+    return metrics
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group('startup')
+    group.add_argument('--startup-runs', type=int, default=10, help='fresh interpreters per entry point')
+    group.add_argument('--startup-target', type=float, default=STARTUP_TARGET, help='cold start budget in seconds')
+    group.add_argument('--startup-profile', action='store_true', help='print the slowest imports of each')
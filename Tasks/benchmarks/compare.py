@@ -0,0 +1,62 @@
+# compare.py
+'''
+Compares two result files of run.py, e.g. from before and after a change.
+
+    python compare.py results/before.json results/after.json
+
+Prints every metric of both with the relative change; changes beyond --threshold are
+marked, and with --fail the exit status is 1 if any is, for use in CI.
+'''
+
+import argparse
+import json
+import math
+
+# Metrics where a bigger number is the better one; for all others smaller is better
+HIGHER_IS_BETTER = ('per_second', 'efficiency')
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def changes(old, new):
+    for bench, metrics in new['results'].items():
+        before = old['results'].get(bench, {})
+        for name, value in metrics.items():
+            previous = before.get(name)
+            if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)):
+                continue
+            if previous:
+                change = (value - previous) / previous
+            else:
+                # Anything from zero, such as failures going 0 -> 7, is beyond every threshold
+                change = math.copysign(math.inf, value) if value else 0.0
+            better = change > 0 if name.endswith(HIGHER_IS_BETTER) else change < 0
+            yield bench, name, previous, value, change, better
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change worth marking')
+    parser.add_argument('--fail', action='store_true', help='exit with 1 when a metric got worse beyond the threshold')
+    args = parser.parse_args()
+
+    old, new = load(args.old), load(args.new)
+    print(f"{(old['environment']['commit'] or '?')[:12]} -> {(new['environment']['commit'] or '?')[:12]}")
+    regressed = False
+    for bench, name, previous, value, change, better in changes(old, new):
+        mark = ''
+        if abs(change) >= args.threshold:
+            mark = 'better' if better else 'WORSE'
+            regressed |= not better
+        print(f'{bench + "." + name:<48} {previous:>12.4g} {value:>12.4g} {change:>+8.1%}  {mark}')
+    if args.fail and regressed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
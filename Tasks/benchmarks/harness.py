@@ -0,0 +1,83 @@
+# harness.py
+'''
+Measuring and recording benchmark runs.
+
+Every benchmark returns a flat dict of numbers. measure() adds the wall time (setup
+included) and the peak resident memory of the process, save() writes them together with
+the commit and the machine, so two result files can be compared with compare.py. Nothing
+traces allocations during the run, so the timings are not slowed down by the measuring.
+The peak memory is the high-water mark of the whole process so far; it belongs to one
+benchmark only when that one is run on its own.
+'''
+
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+TASKS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def use_tasks():
+    # The task scripts import their siblings by name, so their directories go on the path
+    for directory in (TASKS, os.path.join(TASKS, 'PostgreSQL'), os.path.join(TASKS, 'rds_snapshot')):
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def measure(run, *args):
+    # Wall time of run(*args) and the peak memory after it, merged into the metrics it returns
+    started = time.perf_counter()
+    metrics = run(*args)
+    seconds = time.perf_counter() - started
+    return {**metrics, 'wall_seconds': seconds, 'peak_rss_mb': peak_rss_mb()}
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=TASKS, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        # Changes to tracked files only; result files such as --output before.json are not code
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no', '--', '.')),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def save(results, options, path=None):
+    env = environment()
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{(env['commit'] or 'unknown')[:12]}-{datetime.now():%Y%m%d%H%M%S}.json")
+    with open(path, 'w') as f:
+        json.dump({'environment': env, 'options': options, 'results': results}, f, indent=2)
+    return path
+
+
+def format_results(results):
+    lines = []
+    for bench, metrics in results.items():
+        lines.append(bench)
+        for name, value in metrics.items():
+            shown = f'{value:.3f}' if isinstance(value, float) else value
+            lines.append(f'  {name:<44} {shown}')
+    return '\n'.join(lines)
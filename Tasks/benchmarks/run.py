@@ -0,0 +1,60 @@
+# run.py
+'''
+Runs the benchmarks and saves their results for comparing commits.
+
+    python run.py rds monitoring                 # results/<commit>-<time>.json
+    python run.py anonymize --pg-password secret --output before.json
+    python compare.py before.json after.json
+
+Each benchmark needs only its own stand-in: `anonymize` a local Postgres, `rds` moto,
+`monitoring` aiohttp (it starts its own farm of fake websites); `startup` needs nothing.
+'''
+
+import argparse
+import importlib
+import sys
+
+from harness import format_results, measure, save, use_tasks
+
+BENCHMARKS = {
+    'anonymize': 'bench_anonymize',
+    'rds': 'bench_rds',
+    'monitoring': 'bench_monitoring',
+    'startup': 'bench_startup',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the anonymizer, the RDS restores and the site checker')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK', help=f'any of {", ".join(BENCHMARKS)}; default: all')
+    parser.add_argument('--output', help='result file, by default results/<commit>-<time>.json')
+    parser.add_argument('--seed', type=int, default=1, help='for the generated tables and the fake websites')
+    parser.add_argument('--trace', help='also write a Chrome trace / Perfetto timeline; tracing slows the run down a little')
+    # Only the chosen benchmarks are imported, so the others' stand-ins need not be installed.
+    # They are picked from argv before parsing, as their options are not known yet
+    names = [arg for arg in sys.argv[1:] if arg in BENCHMARKS] or list(BENCHMARKS)
+    modules = {name: importlib.import_module(BENCHMARKS[name]) for name in names}
+    for module in modules.values():
+        module.add_arguments(parser)
+    options = parser.parse_args()
+    unknown = [name for name in options.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmark {", ".join(unknown)}, choose from {", ".join(BENCHMARKS)}')
+
+    settings = vars(options).copy()
+    options.tracer = None
+    if options.trace:
+        use_tasks()
+        from tracing import Tracer
+        options.tracer = Tracer()
+
+    results = {name: measure(module.run, options) for name, module in modules.items()}
+    print(format_results(results))
+    print(f'Saved to {save(results, settings, options.output)}')
+    if options.tracer is not None:
+        options.tracer.save(options.trace)
+        print(f'Trace saved to {options.trace}')
+
+
+if __name__ == '__main__':
+    main()
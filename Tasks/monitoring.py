@@ -1,35 +1,805 @@
-import requests
-import smtplib
-from email.mime.text import MIMEText
+import argparse
+import asyncio
+import base64
+import heapq
+import json
+import logging
+import os
+import random
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from urllib.parse import urlsplit
+
+# aiohttp and smtplib are imported where they are used, so importing this module stays cheap
+
+TIMEOUT = 5
+INTERVAL = 60
+# Each next check is scheduled interval * (1 ± JITTER) after the previous one
+JITTER = 0.1
+# Global cap on in-flight probes and a per-host cap so one origin is not hammered
+MAX_CONCURRENCY = 100
+PER_HOST_CONCURRENCY = 4
+
+SMTP_HOST = 'smtp.example.com'
+SMTP_PORT = 587
+SMTP_USER = 'your_email@example.com'
+SMTP_PASSWORD = 'your_password'
+# Alerts raised within ALERT_WINDOW seconds of each other go out as one digest email
+ALERT_WINDOW = 10
+ALERT_QUEUE_SIZE = 1000
+ALERT_BATCH_SIZE = 200
+ALERTS_PER_MINUTE = 6
+SMTP_IDLE_TIMEOUT = 120
+# A digest that fails to send is retried after SEND_BACKOFF, 2 * SEND_BACKOFF, ... seconds, SEND_ATTEMPTS times in all
+SEND_ATTEMPTS = 5
+SEND_BACKOFF = 5
+
+# A site is DOWN after FAIL_THRESHOLD failed checks in a row and UP again after RECOVER_THRESHOLD
+FAIL_THRESHOLD = 3
+RECOVER_THRESHOLD = 2
+# A site that went down and recovered is not alerted as down again within this many seconds
+DEDUP_WINDOW = 30 * 60
+STATE_FILE = 'monitoring_state.json'
+SNAPSHOT_INTERVAL = 60
+
+# Upper bounds of the latency histogram buckets: 1 ms to ~65 s, growing by 25% per bucket
+LATENCY_BUCKETS = tuple(0.001 * 1.25 ** i for i in range(51))
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeResult:
+    '''
+    Outcome of one probe. Timings are in seconds and None when the phase did not happen
+    (e.g. no DNS lookup or connect on a reused keep-alive connection). aiohttp reports
+    the TCP connect and the TLS handshake as one step, so for https `connect` includes
+    TLS and `tls` stays None.
+    '''
+    __slots__ = ('url', 'status', 'error', 'dns', 'connect', 'tls', 'ttfb', 'total', '_started')
+
+    def __init__(self, url):
+        self.url = url
+        self.status = None
+        self.error = None
+        self.dns = None
+        self.connect = None
+        self.tls = None
+        self.ttfb = None
+        self.total = None
+        self._started = time.perf_counter()
+
+    @property
+    def ok(self):
+        return self.status == 200
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if not name.startswith('_')}
+
+    def __repr__(self):
+        return f'ProbeResult({self.url!r}, status={self.status}, error={self.error}, total={self.total})'
+
+
+def _trace_config():
+    import aiohttp
+
+    # Every callback gets the ProbeResult passed as trace_request_ctx to session.get(),
+    # ctx itself is a per-request namespace used to keep the phase start times
+    async def on_dns_resolvehost_start(session, ctx, params):
+        ctx.dns_started = time.perf_counter()
+
+    async def on_dns_resolvehost_end(session, ctx, params):
+        ctx.trace_request_ctx.dns = time.perf_counter() - ctx.dns_started
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connect_started = time.perf_counter()
+
+    async def on_connection_create_end(session, ctx, params):
+        # DNS resolution happens inside connection creation, don't count it twice
+        result = ctx.trace_request_ctx
+        result.connect = time.perf_counter() - ctx.connect_started - (result.dns or 0)
+
+    async def on_request_end(session, ctx, params):
+        result = ctx.trace_request_ctx
+        result.ttfb = time.perf_counter() - result._started
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+class Prober:
+    '''
+    Checks many websites concurrently through one pooled, keep-alive HTTP session.
+    Probes wait on the semaphores before the request is sent, so the timeout only
+    covers the request itself and not the time spent queued behind other sites.
+    '''
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, per_host=PER_HOST_CONCURRENCY, timeout=TIMEOUT, tracer=None):
+        self.max_concurrency = max_concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        # tracing.Tracer, or None to trace nothing
+        self.tracer = tracer
+        self._session = None
+        self._global_limit = None
+        self._host_limits = {}
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        import aiohttp
+
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency,
+                limit_per_host=self.per_host,
+                ttl_dns_cache=300,
+                keepalive_timeout=30,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout), trace_configs=[_trace_config()],
+            )
+            self._global_limit = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    async def probe(self, url, timeout=None) -> ProbeResult:
+        if self.tracer is None:
+            return await self._probe(url, timeout)
+        # Two spans: queued behind the concurrency limits, then the request itself
+        started = self.tracer.clock()
+        result = await self._probe(url, timeout)
+        finished = self.tracer.clock()
+        request_started = finished - result.total
+        self.tracer.complete('probe.wait', 'http', started, request_started, url=url)
+        self.tracer.complete('http.probe', 'http', request_started, finished, url=url, status=result.status,
+                             error=result.error, dns=result.dns, connect=result.connect, ttfb=result.ttfb)
+        return result
+
+    async def _probe(self, url, timeout=None) -> ProbeResult:
+        import aiohttp
+
+        # Always explicit: aiohttp reads timeout=None as "no timeout", not as the session's
+        request_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        async with self._global_limit, self._host_limit(url):
+            result = ProbeResult(url)
+            try:
+                async with self._session.get(url, timeout=request_timeout, trace_request_ctx=result) as response:
+                    result.status = response.status
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                result.error = type(e).__name__
+            result.total = time.perf_counter() - result._started
+            return result
+
+    async def check(self, url, timeout=None) -> bool:
+        return (await self.probe(url, timeout)).ok
+
+    async def probe_all(self, urls) -> dict:
+        results = await asyncio.gather(*(self.probe(url) for url in urls))
+        return dict(zip(urls, results))
+
+    async def check_all(self, urls) -> dict:
+        return {url: result.ok for url, result in (await self.probe_all(urls)).items()}
+
+
+async def probe_websites(urls, **prober_options) -> dict:
+    async with Prober(**prober_options) as prober:
+        return await prober.probe_all(urls)
+
+
+async def check_websites(urls, **prober_options) -> dict:
+    async with Prober(**prober_options) as prober:
+        return await prober.check_all(urls)
+
 
 def check_website(url):
-    try:
-        response = requests.get(url, timeout=5)
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
+    return asyncio.run(check_websites([url]))[url]
+
+
+class SiteMetrics:
+    __slots__ = ('buckets', 'sum', 'count', 'statuses', 'errors')
+
+    def __init__(self):
+        # The last bucket counts everything above the largest bound
+        self.buckets = array('I', bytes(4 * (len(LATENCY_BUCKETS) + 1)))
+        self.sum = 0.0
+        self.count = 0
+        self.statuses = Counter()
+        self.errors = Counter()
+
+
+class Metrics:
+    '''
+    Streaming per-site probe latency histograms with fixed log-scale buckets, so memory
+    per site stays constant however long the monitor runs. Quantiles are interpolated
+    within a bucket, which keeps them within the 25% bucket width of the real value.
+    '''
+
+    def __init__(self):
+        self._sites = {}
+
+    def observe(self, result: ProbeResult):
+        site = self._sites.get(result.url)
+        if site is None:
+            site = self._sites[result.url] = SiteMetrics()
+        if result.error:
+            site.errors[result.error] += 1
+            return
+        site.statuses[result.status] += 1
+        site.buckets[bisect_left(LATENCY_BUCKETS, result.total)] += 1
+        site.sum += result.total
+        site.count += 1
+
+    def quantile(self, url, q):
+        site = self._sites.get(url)
+        if site is None or not site.count:
+            return None
+        rank = q * site.count
+        seen = 0
+        for i, count in enumerate(site.buckets):
+            if count and seen + count >= rank:
+                lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+                upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return LATENCY_BUCKETS[-1]
+
+    def summary(self):
+        return {
+            url: {
+                'count': site.count,
+                'mean': site.sum / site.count if site.count else None,
+                'p50': self.quantile(url, 0.5),
+                'p95': self.quantile(url, 0.95),
+                'p99': self.quantile(url, 0.99),
+                'statuses': {str(status): n for status, n in site.statuses.items()},
+                'errors': dict(site.errors),
+            }
+            for url, site in self._sites.items()
+        }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self):
+        lines = [
+            '# HELP monitoring_probe_duration_seconds Total time of successful probes.',
+            '# TYPE monitoring_probe_duration_seconds histogram',
+        ]
+        for url, site in self._sites.items():
+            label = _prometheus_label(url)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, site.buckets):
+                cumulative += count
+                lines.append(f'monitoring_probe_duration_seconds_bucket{{url="{label}",le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'monitoring_probe_duration_seconds_bucket{{url="{label}",le="+Inf"}} {site.count}')
+            lines.append(f'monitoring_probe_duration_seconds_sum{{url="{label}"}} {site.sum}')
+            lines.append(f'monitoring_probe_duration_seconds_count{{url="{label}"}} {site.count}')
+        lines += [
+            '# HELP monitoring_probe_latency_seconds Probe latency quantiles estimated from the histogram.',
+            '# TYPE monitoring_probe_latency_seconds gauge',
+        ]
+        for url in self._sites:
+            label = _prometheus_label(url)
+            for q in (0.5, 0.95, 0.99):
+                value = self.quantile(url, q)
+                if value is not None:
+                    lines.append(f'monitoring_probe_latency_seconds{{url="{label}",quantile="{q}"}} {value}')
+        lines += [
+            '# HELP monitoring_probe_responses_total Probes that got a response, by status code.',
+            '# TYPE monitoring_probe_responses_total counter',
+        ]
+        for url, site in self._sites.items():
+            label = _prometheus_label(url)
+            for status, n in site.statuses.items():
+                lines.append(f'monitoring_probe_responses_total{{url="{label}",status="{status}"}} {n}')
+        lines += [
+            '# HELP monitoring_probe_errors_total Probes that failed without a response, by error class.',
+            '# TYPE monitoring_probe_errors_total counter',
+        ]
+        for url, site in self._sites.items():
+            label = _prometheus_label(url)
+            for error, n in site.errors.items():
+                lines.append(f'monitoring_probe_errors_total{{url="{label}",error="{error}"}} {n}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        # .json gets JSON, anything else the Prometheus text format (e.g. for the node_exporter textfile collector)
+        content = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+def _prometheus_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Site:
+    __slots__ = ('url', 'interval', 'timeout', 'latency_slo')
+
+    def __init__(self, url, interval=INTERVAL, timeout=TIMEOUT, latency_slo=None):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        # Successful probes slower than this many seconds count as SLO breaches
+        self.latency_slo = latency_slo
+
+    def is_slow(self, result: ProbeResult):
+        return self.latency_slo is not None and result.ok and result.total > self.latency_slo
+
+    def __repr__(self):
+        return f'Site({self.url!r}, interval={self.interval}, timeout={self.timeout}, latency_slo={self.latency_slo})'
+
+
+class Scheduler:
+    '''
+    Long-running check loop. Every site sits in a heap keyed by its next due time;
+    the loop only pops due entries and spawns the probe as a task, so a slow site
+    delays nothing but itself. A site whose previous check is still running is
+    skipped for that tick instead of piling up probes.
+    '''
+
+    def __init__(self, prober, sites, on_result, jitter=JITTER):
+        self.prober = prober
+        self.sites = [site if isinstance(site, Site) else Site(site) for site in sites]
+        self.on_result = on_result
+        self.jitter = jitter
+        self._running = {}
+        self._stop = asyncio.Event()
+
+    def _next_due(self, due, site, now):
+        next_due = due + site.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        # Don't try to catch up on missed ticks after a stall, just resume from now
+        return max(next_due, now)
+
+    async def _check(self, site):
+        try:
+            result = await self.prober.probe(site.url, timeout=site.timeout)
+            await self.on_result(site, result)
+        finally:
+            self._running.pop(site.url, None)
+
+    def stop(self):
+        self._stop.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # Spread the first round over each site's interval so they don't all fire at once
+        heap = [(now + random.uniform(0, site.interval), i, site) for i, site in enumerate(self.sites)]
+        heapq.heapify(heap)
+        while heap and not self._stop.is_set():
+            due, i, site = heap[0]
+            delay = due - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if site.url not in self._running:
+                self._running[site.url] = asyncio.create_task(self._check(site))
+            heapq.heapreplace(heap, (self._next_due(due, site, loop.time()), i, site))
+        for task in list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+
 
 def send_alert(email, message):
+    import smtplib
+    from email.mime.text import MIMEText
+
     msg = MIMEText(message)
     msg['Subject'] = 'Website Down'
-    msg['From'] = 'your_email@example.com'
+    msg['From'] = SMTP_USER
     msg['To'] = email
 
-    with smtplib.SMTP('smtp.example.com', 587) as server:
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
         server.starttls()
-        server.login('your_email@example.com', 'your_password')
-        server.sendmail('your_email@example.com', email, msg.as_string())
+        server.login(SMTP_USER, SMTP_PASSWORD)
+        server.sendmail(SMTP_USER, email, msg.as_string())
+
+
+class AlertDispatcher:
+    '''
+    Sends alerts from its own queue and worker so the monitoring loop never waits on SMTP.
+    Alerts raised within `window` seconds are grouped into one digest, sent over a single
+    authenticated connection that is kept open between digests and closed when idle.
+    submit() never blocks: when the queue is full the alert is dropped and counted, and
+    digests beyond `max_per_minute` are held back, so their alerts join the next digest.
+    A digest the server refuses or that hits a dropped connection is retried with
+    exponential backoff, new alerts joining it, and only given up after `attempts` tries.
+    '''
+
+    def __init__(self, to_addr, host=SMTP_HOST, port=SMTP_PORT, username=SMTP_USER, password=SMTP_PASSWORD,
+                 from_addr=SMTP_USER, starttls=True, window=ALERT_WINDOW, max_queue=ALERT_QUEUE_SIZE,
+                 max_batch=ALERT_BATCH_SIZE, max_per_minute=ALERTS_PER_MINUTE, idle_timeout=SMTP_IDLE_TIMEOUT,
+                 attempts=SEND_ATTEMPTS, backoff=SEND_BACKOFF):
+        self.to_addr = to_addr
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.from_addr = from_addr
+        self.starttls = starttls
+        self.window = window
+        self.max_batch = max_batch
+        self.max_per_minute = max_per_minute
+        self.idle_timeout = idle_timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self._queue = asyncio.Queue(max_queue)
+        self._sent_at = deque()
+        self._smtp = None
+        self._worker = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        # The sentinel is queued behind pending alerts, so they are flushed first
+        if self._worker is not None:
+            await self._queue.put(None)
+            await self._worker
+            self._worker = None
+        await asyncio.to_thread(self._disconnect)
+
+    def submit(self, message, subject='Website Down') -> bool:
+        try:
+            self._queue.put_nowait((subject, message))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f'Alert queue is full, dropping alert: {message}')
+            return False
+
+    async def _run(self):
+        import smtplib
+
+        loop = asyncio.get_running_loop()
+        closing = False
+        # The digest that failed to send last, it goes out again ahead of anything new
+        retry, tries = [], 0
+        while not closing or retry:
+            if retry:
+                batch = retry
+            else:
+                try:
+                    first = await asyncio.wait_for(self._queue.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self._disconnect)
+                    continue
+                if first is None:
+                    break
+                batch = [first]
+                deadline = loop.time() + self.window
+                while len(batch) < self.max_batch:
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), max(deadline - loop.time(), 0))
+                    except asyncio.TimeoutError:
+                        break
+                    if item is None:
+                        closing = True
+                        break
+                    batch.append(item)
+            await self._throttle()
+            # Anything that arrived while rate limited or backing off goes into this digest as well
+            while not closing and len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    closing = True
+                else:
+                    batch.append(item)
+            try:
+                await asyncio.to_thread(self._send, batch)
+                self.sent += len(batch)
+                retry, tries = [], 0
+            except (smtplib.SMTPException, OSError) as e:
+                await asyncio.to_thread(self._disconnect)
+                tries += 1
+                if tries >= self.attempts:
+                    logger.error(f'Giving up on {len(batch)} alert(s) after {tries} attempts: {e}')
+                    self.failed += len(batch)
+                    retry, tries = [], 0
+                    continue
+                delay = self.backoff * 2 ** (tries - 1)
+                logger.warning(f'Failed to send {len(batch)} alert(s), retrying in {delay}s: {e}')
+                retry = batch
+                await asyncio.sleep(delay)
+
+    async def _throttle(self):
+        loop = asyncio.get_running_loop()
+        while self._sent_at and loop.time() - self._sent_at[0] >= 60:
+            self._sent_at.popleft()
+        if len(self._sent_at) >= self.max_per_minute:
+            await asyncio.sleep(60 - (loop.time() - self._sent_at.popleft()))
+        self._sent_at.append(loop.time())
+
+    def _connection(self):
+        import smtplib
+
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            self._smtp = smtp
+        return self._smtp
+
+    def _disconnect(self):
+        import smtplib
+
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self._smtp = None
+
+    def _send(self, batch):
+        import smtplib
+        from email.mime.text import MIMEText
+
+        if len(batch) == 1:
+            subject, body = batch[0]
+        else:
+            subject = f'{len(batch)} monitoring alerts'
+            body = '\n'.join(message for _, message in batch)
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.from_addr
+        msg['To'] = self.to_addr
+        try:
+            self._connection().sendmail(self.from_addr, self.to_addr, msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped the kept-alive connection, reconnect once
+            self._smtp = None
+            self._connection().sendmail(self.from_addr, self.to_addr, msg.as_string())
+
+
+UP, DEGRADED, DOWN = 0, 1, 2
+# What has been alerted for the current incident of a site
+NOT_ALERTED, ALERTED_SLOW, ALERTED_DOWN = 0, 1, 2
+
 
-websites = ['https://example1.com', 'https://example2.com']
+class SiteStates:
+    '''
+    Per-site alert state, stored column-wise in typed arrays with one slot per URL
+    (a few dozen bytes per site), so tens of thousands of targets stay cheap to keep
+    in memory and to snapshot. update() returns 'down', 'slow' or 'recovered' only on
+    the transitions that should be alerted, and None otherwise. Slow probes (latency
+    SLO breaches) count like failures towards DEGRADED; a slow incident escalates to
+    'down' without waiting for the dedup window.
+    '''
+
+    def __init__(self, fail_threshold=FAIL_THRESHOLD, recover_threshold=RECOVER_THRESHOLD, dedup_window=DEDUP_WINDOW):
+        self.fail_threshold = fail_threshold
+        self.recover_threshold = recover_threshold
+        self.dedup_window = dedup_window
+        self._slots = {}
+        self._state = array('b')
+        self._fails = array('H')
+        self._successes = array('H')
+        self._slow = array('H')
+        # What was alerted for the current incident, and when the last alert was sent
+        self._alerted = array('b')
+        self._last_alert = array('d')
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _slot(self, url):
+        slot = self._slots.get(url)
+        if slot is None:
+            slot = self._slots[url] = len(self._slots)
+            self._state.append(UP)
+            self._fails.append(0)
+            self._successes.append(0)
+            self._slow.append(0)
+            self._alerted.append(NOT_ALERTED)
+            self._last_alert.append(float('-inf'))
+        return slot
+
+    def state(self, url):
+        slot = self._slots.get(url)
+        return UP if slot is None else self._state[slot]
+
+    def _can_alert(self, slot, now):
+        # A flapping site opens a new incident at most once per dedup window; if it is
+        # still failing once the window has passed, the suppressed alert goes out then
+        return now - self._last_alert[slot] >= self.dedup_window
+
+    def update(self, url, is_up, now=None, is_slow=False):
+        now = time.time() if now is None else now
+        slot = self._slot(url)
+        if is_up and not is_slow:
+            self._fails[slot] = 0
+            self._slow[slot] = 0
+            self._successes[slot] = min(self._successes[slot] + 1, 0xFFFF)
+            if self._state[slot] != UP and self._successes[slot] >= self.recover_threshold:
+                self._state[slot] = UP
+                if self._alerted[slot] != NOT_ALERTED:
+                    self._alerted[slot] = NOT_ALERTED
+                    return 'recovered'
+            return None
+
+        self._successes[slot] = 0
+        if is_up:
+            # Answering, but slower than the SLO
+            self._fails[slot] = 0
+            self._slow[slot] = min(self._slow[slot] + 1, 0xFFFF)
+            self._state[slot] = DEGRADED
+            if (self._slow[slot] >= self.fail_threshold and self._alerted[slot] == NOT_ALERTED
+                    and self._can_alert(slot, now)):
+                self._alerted[slot] = ALERTED_SLOW
+                self._last_alert[slot] = now
+                return 'slow'
+            return None
+
+        self._slow[slot] = 0
+        self._fails[slot] = min(self._fails[slot] + 1, 0xFFFF)
+        if self._fails[slot] < self.fail_threshold:
+            if self._state[slot] == UP:
+                self._state[slot] = DEGRADED
+            return None
+        self._state[slot] = DOWN
+        if self._alerted[slot] == ALERTED_SLOW or (self._alerted[slot] == NOT_ALERTED and self._can_alert(slot, now)):
+            self._alerted[slot] = ALERTED_DOWN
+            self._last_alert[slot] = now
+            return 'down'
+        return None
+
+    COLUMNS = ('state', 'fails', 'successes', 'slow', 'alerted', 'last_alert')
+
+    def snapshot(self, path=STATE_FILE):
+        # Plain JSON, the columns as base64 of their raw bytes, so restoring never runs code from the file
+        data = {'urls': list(self._slots)}
+        for name in self.COLUMNS:
+            data[name] = base64.b64encode(getattr(self, f'_{name}').tobytes()).decode('ascii')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def restore(self, path=STATE_FILE):
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except ValueError as e:
+            logger.warning(f"Ignoring the alert state in {path}: {e}")
+            return False
+        self._slots = {url: slot for slot, url in enumerate(data['urls'])}
+        for name in self.COLUMNS:
+            column = array(getattr(self, f'_{name}').typecode)
+            # Snapshots written before a column existed restore it as zeros
+            column.frombytes(base64.b64decode(data[name]) if name in data else bytes(column.itemsize * len(self._slots)))
+            setattr(self, f'_{name}', column)
+        return True
+
+
+def alert_message(site, event, result=None):
+    if event == 'down':
+        return 'Website Down', f'Website {site.url} is down!'
+    if event == 'slow':
+        return 'Website Slow', f'Website {site.url} took {result.total:.2f}s, above its {site.latency_slo}s latency SLO'
+    return 'Website Recovered', f'Website {site.url} is back up.'
+
+
+websites = [
+    Site('https://example1.com', interval=30, latency_slo=1.5),
+    Site('https://example2.com', interval=300, timeout=10),
+]
 email = 'client_email@example.com'
 
-for site in websites:
-    if not check_website(site):
-        send_alert(email, f'Website {site} is down!')
+
+def handle_result(site, result, states, alerts, metrics=None):
+    if metrics is not None:
+        metrics.observe(result)
+    if event := states.update(site.url, result.ok, is_slow=site.is_slow(result)):
+        subject, message = alert_message(site, event, result)
+        alerts.submit(message, subject=subject)
+
+
+async def serve(sites, state_file=STATE_FILE, metrics_file=None, tracer=None):
+    states = SiteStates()
+    states.restore(state_file)
+    metrics = Metrics()
+
+    def save():
+        states.snapshot(state_file)
+        if metrics_file:
+            metrics.write(metrics_file)
+
+    async def save_periodically():
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            save()
+
+    async with Prober(tracer=tracer) as prober, AlertDispatcher(email) as alerts:
+        async def on_result(site, result):
+            handle_result(site, result, states, alerts, metrics)
+
+        saver = asyncio.create_task(save_periodically())
+        try:
+            await Scheduler(prober, sites, on_result).run()
+        finally:
+            saver.cancel()
+            save()
+
+
+async def check_once(sites, state_file=STATE_FILE, tracer=None):
+    # Each cron run picks up where the previous one stopped, so a site that stays
+    # down is alerted once rather than on every run
+    states = SiteStates()
+    states.restore(state_file)
+    results = await probe_websites([site.url for site in sites], tracer=tracer)
+    async with AlertDispatcher(email) as alerts:
+        for site in sites:
+            handle_result(site, results[site.url], states, alerts)
+    states.snapshot(state_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check websites and send an email when they are down')
+    parser.add_argument('--serve', action='store_true', help='keep running and check each site on its own interval')
+    parser.add_argument('--state-file', default=STATE_FILE, help='where alert state is kept between runs')
+    parser.add_argument('--metrics-file', help='with --serve, write latency metrics here (.json for JSON, else Prometheus text)')
+    parser.add_argument('--trace', help='write a Chrome trace / Perfetto timeline of the probes to this file on exit; kept in memory, so for short runs')
+    args = parser.parse_args()
+
+    tracer = None
+    if args.trace:
+        from tracing import Tracer
+        tracer = Tracer()
+    try:
+        if args.serve:
+            asyncio.run(serve(websites, args.state_file, args.metrics_file, tracer))
+        else:
+            asyncio.run(check_once(websites, args.state_file, tracer))
+    finally:
+        if tracer is not None:
+            tracer.save(args.trace)
 
 
 '''
-Python, который будет периодически проверять доступность сайтов 
-с помощью curl или requests и отправлять уведомления по email 
+Python, который будет периодически проверять доступность сайтов
+с помощью curl или requests и отправлять уведомления по email
 или в мессенджеры (например, через API Telegram или Slack).
-'''
\ No newline at end of file
+'''
@@ -0,0 +1,232 @@
+# pipeline.py
+'''
+Restores an instance from a shared snapshot, anonymizes it and keeps the result as a snapshot.
+
+    restore -> connect -> anonymize -> snapshot -> destroy
+
+The restore is only started, not waited for: tables are anonymized as soon as the instance
+accepts connections, before RDS reports it 'available', and each database's tables as soon
+as that database is discovered (PSQL.anonymize_streamed). The output snapshot is taken once
+every table succeeded, then the instance is destroyed. The local copy of the shared snapshot
+comes from RDS (its copy cache); every other call and wait goes through AsyncRDS, on the
+same event loop as the anonymizer.
+
+Finished stages and their durations are written to the state file after each stage, so a
+run that crashed is started again with the same arguments and picks up after the last
+completed stage; a crash during anonymization repeats it, with chunked tables resuming
+from their own checkpoint (<target>.anonymize_chunks.json, valid for that restore only).
+
+    python pipeline.py anon-db anon-nightly staging-db --secret-id db-pass-prod
+'''
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, 'PostgreSQL'), os.path.join(HERE, 'rds_snapshot')]
+
+from chunked import STATE_FILE as CHUNK_STATE_FILE
+from db import CONCURRENCY, MAINTENANCE_DB, PSQL
+from aio import AsyncRDS
+from rds_new import RDS, RDSException
+from tracing import Tracer, instrument_boto
+from waiters import INSTANCE_FAILED, Waiter
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('restore', 'connect', 'anonymize', 'snapshot', 'destroy')
+STATE_FILE = 'pipeline_state.json'
+# How long a restored instance may take to get an endpoint and accept connections
+CONNECT_DEADLINE = 60 * 60
+
+
+class PipelineState:
+    '''
+    Progress of one run, keyed by target instance: completed stages with their durations,
+    plus what later stages need (endpoint, output snapshot name).
+    '''
+
+    def __init__(self, path, target):
+        self.path = path
+        self.target = target
+        self._runs = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._runs = json.load(f)
+        self.run = self._runs.setdefault(target, {'timings': {}})
+        if all(self.done(stage) for stage in STAGES):
+            # The previous run of this target finished, this is a new one
+            self.run = self._runs[target] = {'timings': {}}
+
+    @property
+    def timings(self):
+        return self.run['timings']
+
+    def done(self, stage):
+        return stage in self.timings
+
+    def finish(self, stage, seconds):
+        self.timings[stage] = seconds
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        # A crash while writing must not leave a truncated file behind
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._runs, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class Pipeline:
+    def __init__(self, rds: RDS, aio: AsyncRDS, password, snapshot, target, config_from, output_snapshot=None,
+                 concurrency=CONCURRENCY, state_file=STATE_FILE, tracer=None):
+        self.rds = rds
+        # Entered already, so its client exists
+        self.aio = aio
+        self.password = password
+        self.snapshot_identifier = snapshot
+        self.target_db_identifier = target
+        self.config_from_db_identifier = config_from
+        self.concurrency = concurrency
+        # tracing.Tracer, or None; given one, the stages, queries and RDS calls are traced,
+        # and the waiter polls too when rds and aio were made with the same tracer
+        self.tracer = tracer
+        if tracer is not None:
+            instrument_boto(rds.rds_client, tracer)
+            instrument_boto(aio.rds_client, tracer)
+        self.state = PipelineState(state_file, target)
+        # Named once per run, so a resumed run waits for the same snapshot
+        self.state.run.setdefault(
+            'output_snapshot', output_snapshot or f"{target}-anonymized-{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+        )
+        self.results = []
+
+    async def run(self):
+        for stage in STAGES:
+            if self.state.done(stage):
+                logger.info(f"Stage '{stage}' already completed -- skipping")
+                continue
+            started = time.perf_counter()
+            with self.tracer.span(stage, 'stage') if self.tracer else nullcontext():
+                await getattr(self, stage)()
+            seconds = time.perf_counter() - started
+            logger.info(f"Stage '{stage}' completed in {seconds:.0f}s")
+            self.state.finish(stage, seconds)
+        return self.state.timings
+
+    async def restore(self):
+        # Start the restore only; connect() waits for just as much as anonymizing needs
+        copy = await asyncio.to_thread(self.rds.local_copy, self.snapshot_identifier)
+        await self.aio.restore_instance(
+            copy['DBSnapshotIdentifier'], self.target_db_identifier, self.config_from_db_identifier, wait=False,
+        )
+
+    async def connect(self):
+        def endpoint_status(response):
+            instance = response['DBInstances'][0]
+            return 'has-endpoint' if instance.get('Endpoint', {}).get('Address') else instance['DBInstanceStatus']
+
+        started = time.monotonic()
+        response = await Waiter(min_delay=15.0, tracer=self.tracer).wait_async(
+            lambda: self.aio.describe_instance(self.target_db_identifier), endpoint_status, {'has-endpoint'}, INSTANCE_FAILED,
+            CONNECT_DEADLINE, f"Waiting for an endpoint ({self.target_db_identifier})",
+        )
+        instance = response['DBInstances'][0]
+        endpoint = instance['Endpoint']['Address']
+        # Connect as the master user of the restored instance, on its port
+        self.state.run['port'] = instance['Endpoint']['Port']
+        self.state.run['user'] = instance['MasterUsername']
+
+        # The endpoint resolves a while before Postgres accepts connections
+        import asyncpg
+
+        attempt = 0
+        async with self._psql(endpoint) as psql:
+            while True:
+                try:
+                    await psql.get_pool(MAINTENANCE_DB)
+                    break
+                except (OSError, asyncio.TimeoutError, asyncpg.CannotConnectNowError) as e:
+                    if time.monotonic() - started >= CONNECT_DEADLINE:
+                        raise RDSException(f"{endpoint} does not accept connections: {e}") from e
+                    attempt += 1
+                    await asyncio.sleep(min(5 * attempt, 30))
+        logger.info(f"{endpoint} accepts connections")
+        self.state.run['endpoint'] = endpoint
+        # New for every restore, so chunk checkpoints of an earlier restore of this target are never trusted
+        self.state.run['instance'] = instance['DbiResourceId']
+
+    def _psql(self, endpoint):
+        return PSQL(endpoint, self.password, self.concurrency, self.state.run['user'], self.state.run['port'], self.tracer)
+
+    async def anonymize(self):
+        async with self._psql(self.state.run['endpoint']) as psql:
+            self.results = await psql.anonymize_streamed(
+                state_file=f'{self.target_db_identifier}.{CHUNK_STATE_FILE}', instance=self.state.run['instance'],
+            )
+            logger.info(f"Connection acquire waits: {psql.acquire_wait_stats()}")
+        failed = [result for result in self.results if not result.ok]
+        for result in failed:
+            logger.error(f"Failed to anonymize {result.table or 'any table'} in {result.db}: {result.error}")
+        if failed:
+            # A partly anonymized instance must never end up in the output snapshot
+            raise RDSException(f"{len(failed)} of {len(self.results)} tables failed, not taking a snapshot")
+        logger.info(f"Anonymized {len(self.results)} tables")
+
+    async def snapshot(self):
+        # Anonymizing may have started before the instance was 'available'; a snapshot needs it to be
+        await self.aio.wait_db(self.target_db_identifier)
+        await self.aio.create_snapshot(self.target_db_identifier, self.state.run['output_snapshot'])
+
+    async def destroy(self):
+        await self.aio.delete_instance(self.target_db_identifier)
+
+
+def format_timings(timings):
+    lines = [f'{stage:<10} {timings[stage]:>8.0f}s' if stage in timings else f'{stage:<10} {"-":>9}' for stage in STAGES]
+    lines.append(f'{"total":<10} {sum(timings.values()):>8.0f}s')
+    return '\n'.join(lines)
+
+
+async def main(args):
+    import boto3
+
+    logging.basicConfig(level=logging.INFO)
+    session = boto3.session.Session(profile_name=args.profile)
+    password = session.client('secretsmanager').get_secret_value(SecretId=args.secret_id)['SecretString']
+    tracer = Tracer() if args.trace else None
+    async with AsyncRDS(args.profile, tracer=tracer) as aio:
+        pipeline = Pipeline(
+            RDS(args.profile, tracer), aio, password, args.snapshot, args.target, args.config_from,
+            args.output_snapshot, args.concurrency, args.state_file, tracer,
+        )
+        try:
+            timings = await pipeline.run()
+        finally:
+            if tracer is not None:
+                tracer.save(args.trace)
+    print(format_timings(timings))
+    print(f"Output snapshot: {pipeline.state.run['output_snapshot']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Restore, anonymize and snapshot an RDS instance in one run')
+    parser.add_argument('snapshot', help='shared snapshot (source DBInstanceIdentifier) to restore from')
+    parser.add_argument('target', help='identifier of the temporary instance')
+    parser.add_argument('config_from', help='instance whose subnet group and class are copied')
+    parser.add_argument('--output-snapshot', help='name of the anonymized snapshot, by default <target>-anonymized-<time>')
+    parser.add_argument('--secret-id', default='db-pass-prod', help='Secrets Manager secret with the database password')
+    parser.add_argument('--profile', help='AWS profile name')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='anonymize_table() calls in flight at once')
+    parser.add_argument('--state-file', default=STATE_FILE, help='completed stages, used to resume a crashed run')
+    parser.add_argument('--trace', help='write a Chrome trace / Perfetto timeline of the run to this file')
+    asyncio.run(main(parser.parse_args()))
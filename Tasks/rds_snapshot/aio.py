@@ -0,0 +1,149 @@
+# aio.py
+'''
+asyncio client layer for the RDS operations of this package, on top of aiobotocore.
+
+Every call is a coroutine and the waiters are awaitable, so one event loop can follow
+hundreds of snapshot copies and restores at once instead of one blocked thread each.
+API calls share one semaphore and the throttling-aware retry from waiters.py.
+pipeline.py makes its API calls and waits through this layer. The synchronous RDS class in
+rds_new.py stays on plain boto3 rather than wrapping these coroutines: its copy cache and warm
+pool call it from worker threads, which would each need an event loop and a client of their
+own, and aiobotocore does not run under moto's in-process mock_aws that bench_rds.py uses.
+Both build the restore request with restore_parameters(), and test_aio.py runs both against
+the same moto server.
+
+    async with AsyncRDS(endpoint_url='http://localhost:5000') as rds:   # e.g. moto in server mode
+        copies = await asyncio.gather(*(rds.copy_snapshot(arn, name, kms) for arn, name in sources))
+        await asyncio.gather(*(rds.wait_snapshot(c['DBSnapshotIdentifier']) for c in copies))
+'''
+
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+
+from waiters import (
+    INSTANCE_FAILED, INSTANCE_READY, SNAPSHOT_FAILED, SNAPSHOT_READY, Waiter, call_with_retry_async,
+    instance_status, predict_snapshot, snapshot_deadline, snapshot_status,
+)
+
+logger = logging.getLogger(__name__)
+
+# API calls in flight at once, shared by everything using one AsyncRDS
+MAX_API_CALLS = 20
+
+
+def restore_parameters(config_instance, snapshot_identifier, target_db_identifier, tags=None):
+    # A restore with the subnet group and class of an existing instance
+    return dict(
+        DBInstanceIdentifier=target_db_identifier,
+        DBSnapshotIdentifier=snapshot_identifier,
+        DBSubnetGroupName=config_instance['DBSubnetGroup']['DBSubnetGroupName'],
+        DBInstanceClass=config_instance['DBInstanceClass'],
+        Tags=tags or [],
+    )
+
+
+class AsyncRDS:
+    def __init__(self, aws_profile_name=None, region_name=None, endpoint_url=None, max_api_calls=MAX_API_CALLS, tracer=None):
+        from aiobotocore.session import AioSession
+
+        self.session = AioSession(profile=aws_profile_name)
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self.rds_client = None
+        # tracing.Tracer for the waiter polls, or None
+        self.tracer = tracer
+        self._api_limit = asyncio.Semaphore(max_api_calls)
+        self._stack = None
+
+    async def __aenter__(self):
+        self._stack = AsyncExitStack()
+        self.rds_client = await self._stack.enter_async_context(
+            self.session.create_client('rds', region_name=self.region_name, endpoint_url=self.endpoint_url)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._stack.aclose()
+        self.rds_client = None
+
+    async def _call(self, operation, **kwargs):
+        async with self._api_limit:
+            return await call_with_retry_async(getattr(self.rds_client, operation), **kwargs)
+
+    async def describe_snapshots(self, **kwargs):
+        # All pages, one call at a time through the shared limit and retry
+        snapshots = []
+        while True:
+            page = await self._call('describe_db_snapshots', **kwargs)
+            snapshots += page['DBSnapshots']
+            if not page.get('Marker'):
+                return snapshots
+            kwargs['Marker'] = page['Marker']
+
+    async def describe_snapshot(self, identifier):
+        return await self._call('describe_db_snapshots', DBSnapshotIdentifier=identifier)
+
+    async def describe_instance(self, identifier):
+        return await self._call('describe_db_instances', DBInstanceIdentifier=identifier)
+
+    async def copy_snapshot(self, source_arn, target_identifier, kms_key_id, tags=None):
+        response = await self._call(
+            'copy_db_snapshot',
+            SourceDBSnapshotIdentifier=source_arn,
+            TargetDBSnapshotIdentifier=target_identifier,
+            KmsKeyId=kms_key_id,
+            Tags=tags or [],
+        )
+        return response['DBSnapshot']
+
+    async def delete_snapshot(self, identifier):
+        try:
+            await self._call('delete_db_snapshot', DBSnapshotIdentifier=identifier)
+        except self.rds_client.exceptions.DBSnapshotNotFoundFault:
+            logger.info(f"RDS snapshot {identifier} is not found -- nothing to delete")
+
+    async def restore_instance(self, snapshot_identifier, target_db_identifier, config_from_db_identifier, tags=None, wait=True):
+        # As RDS.restore_from_copy(): with wait=False only the restore is started, and the endpoint
+        # is returned if RDS already has one
+        current_instance = (await self.describe_instance(config_from_db_identifier))['DBInstances'][0]
+        try:
+            await self._call(
+                'restore_db_instance_from_db_snapshot',
+                **restore_parameters(current_instance, snapshot_identifier, target_db_identifier, tags),
+            )
+        except self.rds_client.exceptions.DBInstanceAlreadyExistsFault:
+            logger.info("RDS Instance already exists -- using it")
+        instance = await self.wait_db(target_db_identifier) if wait else await self.describe_instance(target_db_identifier)
+        return instance['DBInstances'][0].get('Endpoint', {}).get('Address')
+
+    async def create_snapshot(self, db_identifier, snapshot_identifier):
+        logger.info(f"Creating RDS snapshot '{snapshot_identifier}' of '{db_identifier}'")
+        try:
+            await self._call('create_db_snapshot', DBSnapshotIdentifier=snapshot_identifier, DBInstanceIdentifier=db_identifier)
+        except self.rds_client.exceptions.DBSnapshotAlreadyExistsFault:
+            logger.info(f"RDS snapshot {snapshot_identifier} already exists -- using it")
+        return (await self.wait_snapshot(snapshot_identifier))['DBSnapshots'][0]
+
+    async def delete_instance(self, db_identifier):
+        try:
+            await self._call(
+                'delete_db_instance',
+                DBInstanceIdentifier=db_identifier,
+                SkipFinalSnapshot=True,
+                DeleteAutomatedBackups=True,
+            )
+        except self.rds_client.exceptions.DBInstanceNotFoundFault:
+            logger.info(f"RDS instance with identifier {db_identifier} is not found -- nothing to delete")
+
+    async def wait_snapshot(self, identifier, message="Waiting for RDS snapshot to be available", deadline=None, waiter=None):
+        return await (waiter or Waiter(tracer=self.tracer)).wait_async(
+            lambda: self.describe_snapshot(identifier), snapshot_status, SNAPSHOT_READY, SNAPSHOT_FAILED,
+            deadline or snapshot_deadline, f"{message} ({identifier})", predict=predict_snapshot,
+        )
+
+    async def wait_db(self, identifier, message="Waiting for RDS instance to be stable", deadline=60 * 60, waiter=None):
+        return await (waiter or Waiter(min_delay=15.0, tracer=self.tracer)).wait_async(
+            lambda: self.describe_instance(identifier), instance_status, INSTANCE_READY, INSTANCE_FAILED,
+            deadline, f"{message} ({identifier})",
+        )
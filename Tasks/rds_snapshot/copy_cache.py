@@ -0,0 +1,122 @@
+# copy_cache.py
+'''
+Local copies of shared snapshots, reused for as long as the shared source is unchanged.
+
+Every copy is tagged with the ARN and the create time of the shared snapshot it was made
+from, and gets a unique name with that create time in it, so a refresh never collides with
+the previous copy. A copy is reused only when its tags match the newest shared snapshot;
+matching on the source and not on ages alone avoids re-copying (tens of minutes across KMS
+keys) when nothing changed. Superseded copies are evicted least recently used first:
+at most `keep` copies per source instance are kept, and superseded ones not used within
+`retention` are deleted even below that. Manual snapshots without the cache's tags are
+never touched.
+'''
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+from waiters import call_with_retry
+
+logger = logging.getLogger(__name__)
+
+SOURCE_ARN_TAG = 'anon-copy:source-arn'
+SOURCE_TIME_TAG = 'anon-copy:source-create-time'
+LAST_USED_TAG = 'anon-copy:last-used'
+KEEP_COPIES = 2
+RETENTION = timedelta(days=1)
+
+
+def tags(snapshot):
+    return {tag['Key']: tag['Value'] for tag in snapshot.get('TagList', [])}
+
+
+def copy_name(shared):
+    return f"{shared['DBInstanceIdentifier']}-copy-{shared['SnapshotCreateTime']:%Y%m%d%H%M%S}"
+
+
+class CopyCache:
+    def __init__(self, client, inventory, kms_key_id, wait_snapshot, keep=KEEP_COPIES, retention=RETENTION):
+        self.client = client
+        self.inventory = inventory
+        self.kms_key_id = kms_key_id
+        self.wait_snapshot = wait_snapshot
+        self.keep = keep
+        self.retention = retention
+
+    def find(self, shared):
+        source_time = shared['SnapshotCreateTime'].isoformat()
+        for snapshot in self.inventory.manual(shared['DBInstanceIdentifier']):
+            snapshot_tags = tags(snapshot)
+            if snapshot_tags.get(SOURCE_ARN_TAG) == shared['DBSnapshotArn'] and snapshot_tags.get(SOURCE_TIME_TAG) == source_time:
+                return snapshot
+        return None
+
+    def touch(self, snapshot):
+        now = datetime.now(timezone.utc).isoformat()
+        self.client.add_tags_to_resource(
+            ResourceName=snapshot['DBSnapshotArn'],
+            Tags=[{'Key': LAST_USED_TAG, 'Value': now}],
+        )
+
+    def get_or_copy(self, shared):
+        copy = self.find(shared)
+        if copy is not None and copy['Status'] == 'available':
+            logger.info(f"Reusing local copy {copy['DBSnapshotIdentifier']} of {shared['DBSnapshotArn']}")
+        elif copy is not None:
+            # Another run already started this copy
+            logger.info(f"Waiting for local copy {copy['DBSnapshotIdentifier']} in progress")
+            copy = self.wait_snapshot(self.client, copy['DBSnapshotIdentifier'], message="Waiting for RDS snapshot copy")['DBSnapshots'][0]
+        else:
+            copy = self._copy(shared)
+        self.touch(copy)
+        self.inventory.invalidate(shared['DBInstanceIdentifier'])
+        self.evict(shared['DBInstanceIdentifier'], current=copy)
+        return copy
+
+    def _copy(self, shared):
+        name = copy_name(shared)
+        logger.info(f"Copying {shared['DBSnapshotArn']} to {name}")
+        try:
+            self.client.copy_db_snapshot(
+                SourceDBSnapshotIdentifier=shared['DBSnapshotArn'],
+                TargetDBSnapshotIdentifier=name,
+                KmsKeyId=self.kms_key_id,
+                Tags=[
+                    {'Key': SOURCE_ARN_TAG, 'Value': shared['DBSnapshotArn']},
+                    {'Key': SOURCE_TIME_TAG, 'Value': shared['SnapshotCreateTime'].isoformat()},
+                ],
+            )
+        except self.client.exceptions.DBSnapshotAlreadyExistsFault:
+            # The name contains the source create time, so an existing one is a copy of the same source
+            logger.info(f"Local copy {name} already exists -- using it")
+        return self.wait_snapshot(self.client, name, message="Waiting for RDS snapshot copy")['DBSnapshots'][0]
+
+    def evict(self, db_instance_identifier, current):
+        now = datetime.now(timezone.utc)
+
+        def last_used(snapshot):
+            value = tags(snapshot).get(LAST_USED_TAG)
+            return datetime.fromisoformat(value) if value else snapshot['SnapshotCreateTime']
+
+        superseded = [
+            s for s in self.inventory.manual(db_instance_identifier)
+            # Only copies this cache made; other manual snapshots of the instance are not ours to delete.
+            # Snapshots without SnapshotCreateTime are still being created
+            if SOURCE_ARN_TAG in tags(s) and s['DBSnapshotIdentifier'] != current['DBSnapshotIdentifier']
+            and s.get('SnapshotCreateTime')
+        ]
+        superseded.sort(key=last_used, reverse=True)
+        for position, snapshot in enumerate(superseded):
+            # The current copy takes one of the `keep` places
+            if position + 1 < self.keep and now - last_used(snapshot) < self.retention:
+                continue
+            name = snapshot['DBSnapshotIdentifier']
+            try:
+                call_with_retry(self.client.delete_db_snapshot, DBSnapshotIdentifier=name)
+                logger.info(f"Evicted superseded local copy {name}")
+            except self.client.exceptions.DBSnapshotNotFoundFault:
+                pass
+            except self.client.exceptions.InvalidDBSnapshotStateFault as e:
+                # Still being copied or restored from elsewhere; a later eviction gets it
+                logger.info(f"Keeping superseded local copy {name} for now: {e}")
+        self.inventory.invalidate(db_instance_identifier)
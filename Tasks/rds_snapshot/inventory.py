@@ -0,0 +1,83 @@
+# inventory.py
+'''
+Cached, paginated listing of RDS snapshots.
+
+Shared snapshots are listed once (all pages) and indexed by DBInstanceIdentifier;
+local manual snapshots are listed per source instance with the DBInstanceIdentifier
+filter applied by the API. Both are cached for `ttl` seconds, so several restores in
+one process share a single listing instead of each one describing the whole account.
+'''
+
+import logging
+import threading
+import time
+
+from waiters import call_with_retry
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_TTL = 5 * 60
+PAGE_SIZE = 100
+
+
+class SnapshotInventory:
+    def __init__(self, client, ttl=INVENTORY_TTL, clock=time.monotonic):
+        self.client = client
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._shared = None
+        self._shared_at = None
+        # DBInstanceIdentifier -> (listed at, snapshots)
+        self._manual = {}
+        self.api_calls = 0
+
+    def _paginate(self, **kwargs):
+        marker = None
+        while True:
+            if marker:
+                kwargs['Marker'] = marker
+            page = call_with_retry(self.client.describe_db_snapshots, MaxRecords=PAGE_SIZE, **kwargs)
+            self.api_calls += 1
+            yield from page['DBSnapshots']
+            marker = page.get('Marker')
+            if not marker:
+                return
+
+    def _fresh(self, listed_at):
+        return listed_at is not None and self.clock() - listed_at < self.ttl
+
+    def shared(self, db_instance_identifier):
+        # One listing of every shared snapshot serves all identifiers until it expires
+        with self._lock:
+            if not self._fresh(self._shared_at):
+                index = {}
+                for snapshot in self._paginate(SnapshotType='shared', IncludeShared=True):
+                    index.setdefault(snapshot['DBInstanceIdentifier'], []).append(snapshot)
+                self._shared, self._shared_at = index, self.clock()
+                logger.info(f"Listed shared snapshots of {len(index)} instances")
+            return self._shared.get(db_instance_identifier, [])
+
+    def manual(self, db_instance_identifier):
+        with self._lock:
+            listed_at, snapshots = self._manual.get(db_instance_identifier, (None, None))
+            if not self._fresh(listed_at):
+                snapshots = list(self._paginate(DBInstanceIdentifier=db_instance_identifier, SnapshotType='manual'))
+                self._manual[db_instance_identifier] = (self.clock(), snapshots)
+            return snapshots
+
+    def newest_shared(self, db_instance_identifier):
+        # Only 'available' ones, a snapshot that is still being created may conflict with the copy
+        available = [s for s in self.shared(db_instance_identifier) if s['Status'] == 'available']
+        if not available:
+            return None
+        return max(available, key=lambda s: s['SnapshotCreateTime'])
+
+    def invalidate(self, db_instance_identifier=None):
+        # Call after creating or deleting snapshots so the next lookup lists them again
+        with self._lock:
+            if db_instance_identifier is None:
+                self._shared_at = None
+                self._manual.clear()
+            else:
+                self._manual.pop(db_instance_identifier, None)
@@ -0,0 +1,53 @@
+# main.py
+'''
+Restores many RDS instances from shared snapshots at the same time.
+
+Only the command line lives here, the work is done by orchestrator.py, which can be
+imported without click. boto3 is only imported once the RDS client is created, so
+--help and argument errors come back right away.
+
+    python main.py -j anon-db:anon-staging:staging-db -j anon-db:anon-qa:qa-db --report report.json
+'''
+
+import json
+import logging
+
+import click
+
+from orchestrator import MAX_CONCURRENT_COPIES, MAX_CONCURRENT_RESTORES, Orchestrator, RestoreJob, format_report
+from rds_new import RDS
+
+
+def parse_job(value):
+    parts = value.split(':')
+    if len(parts) != 3 or not all(parts):
+        raise click.BadParameter(f"expected SNAPSHOT:TARGET:CONFIG_FROM, got '{value}'")
+    return RestoreJob(*parts)
+
+
+@click.command()
+@click.option('-j', '--job', 'job_specs', multiple=True, help='SNAPSHOT:TARGET:CONFIG_FROM, can be repeated')
+@click.option('--jobs-file', type=click.File(), help='JSON list of {"snapshot", "target", "config_from"} objects')
+@click.option('--profile', help='AWS profile name')
+@click.option('--max-copies', default=MAX_CONCURRENT_COPIES, show_default=True, help='snapshot copies in progress at once')
+@click.option('--max-restores', default=MAX_CONCURRENT_RESTORES, show_default=True, help='jobs running at once')
+@click.option('--report', type=click.Path(dir_okay=False, writable=True), help='also write the per-job report as JSON')
+def main(job_specs, jobs_file, profile, max_copies, max_restores, report):
+    logging.basicConfig(level=logging.INFO)
+    jobs = [parse_job(spec) for spec in job_specs]
+    if jobs_file:
+        jobs += [RestoreJob(j['snapshot'], j['target'], j['config_from']) for j in json.load(jobs_file)]
+    if not jobs:
+        raise click.UsageError('no jobs given, use --job or --jobs-file')
+
+    results = Orchestrator(RDS(profile), max_copies, max_restores).run(jobs)
+    click.echo(format_report(results))
+    if report:
+        with open(report, 'w') as f:
+            json.dump([job.as_dict() for job in results], f, indent=2)
+    if any(job.error for job in results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
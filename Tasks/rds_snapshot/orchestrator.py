@@ -0,0 +1,96 @@
+# orchestrator.py
+'''
+Parallel restores of many targets, the engine behind main.py.
+
+Every job is (shared snapshot, target instance, instance to copy the configuration from).
+Jobs run in parallel threads; jobs of the same shared snapshot wait for one local copy
+instead of each making their own. Copies and restores have separate concurrency limits
+to stay under the RDS quotas on concurrent snapshot copies and API calls.
+'''
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from rds_new import RDS, logger
+
+# RDS allows a limited number of snapshot copies in progress per region
+MAX_CONCURRENT_COPIES = 5
+MAX_CONCURRENT_RESTORES = 10
+
+
+class RestoreJob:
+    __slots__ = ('snapshot', 'target', 'config_from', 'endpoint', 'error',
+                 'copy_reused', 'copy_seconds', 'restore_seconds', 'total_seconds')
+
+    def __init__(self, snapshot, target, config_from):
+        self.snapshot = snapshot
+        self.target = target
+        self.config_from = config_from
+        self.endpoint = None
+        self.error = None
+        # Whether the job used a local copy made for another job in this run
+        self.copy_reused = False
+        self.copy_seconds = None
+        self.restore_seconds = None
+        self.total_seconds = None
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Orchestrator:
+    def __init__(self, rds: RDS, max_copies=MAX_CONCURRENT_COPIES, max_restores=MAX_CONCURRENT_RESTORES):
+        self.rds = rds
+        self.max_restores = max_restores
+        self._copy_limit = threading.Semaphore(max_copies)
+        self._lock = threading.Lock()
+        # Shared snapshot -> Future of its local copy, so each one is copied once per run
+        self._copies = {}
+
+    def _local_copy(self, snapshot):
+        with self._lock:
+            future = self._copies.get(snapshot)
+            owner = future is None
+            if owner:
+                future = self._copies[snapshot] = Future()
+        if owner:
+            try:
+                with self._copy_limit:
+                    future.set_result(self.rds.local_copy(snapshot))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result(), not owner
+
+    def _run(self, job: RestoreJob):
+        started = time.perf_counter()
+        try:
+            copy, job.copy_reused = self._local_copy(job.snapshot)
+            job.copy_seconds = time.perf_counter() - started
+            restore_started = time.perf_counter()
+            job.endpoint = self.rds.restore_from_copy(copy, job.target, job.config_from)
+            job.restore_seconds = time.perf_counter() - restore_started
+        except Exception as e:
+            logger.error(f"Restoring '{job.target}' from '{job.snapshot}' failed: {e}")
+            job.error = str(e)
+        job.total_seconds = time.perf_counter() - started
+        return job
+
+    def run(self, jobs):
+        # Each restore is mostly waiting on RDS, so a thread per job is plenty
+        with ThreadPoolExecutor(max_workers=self.max_restores) as executor:
+            return list(executor.map(self._run, jobs))
+
+
+def format_report(jobs):
+    def seconds(value):
+        return f'{value:.0f}s' if value is not None else '-'
+
+    lines = [f'{"target":<30} {"snapshot":<30} {"copy":>8} {"restore":>8} {"total":>8}  result']
+    for job in jobs:
+        copy = seconds(job.copy_seconds) + ('*' if job.copy_reused else '')
+        result = job.endpoint if job.error is None else f'FAILED: {job.error}'
+        lines.append(f'{job.target:<30} {job.snapshot:<30} {copy:>8} {seconds(job.restore_seconds):>8} '
+                     f'{seconds(job.total_seconds):>8}  {result}')
+    lines.append('* waited for a local copy made by another job')
+    return '\n'.join(lines)
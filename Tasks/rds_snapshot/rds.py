@@ -9,14 +9,12 @@ If the shared version is updated, we delete the local copy and make a new copy f
 ######################################################################################################
 
 
-import time
 from datetime import datetime, timedelta
 from typing import TYPE_CHECKING
 
-import boto3
-import click
-
 from logger import Logger
+import waiters
+from waiters import call_with_retry
 
 if TYPE_CHECKING:
     from mypy_boto3_rds import RDSClient
@@ -26,6 +24,8 @@ class RDS:
     RDS_KMS = "arn:aws:kms:eu-central-1:123456789012:alias/shared_kms"
 
     def __init__(self, aws_profile_name=None):
+        import boto3
+
         session = boto3.session.Session(profile_name=aws_profile_name)
         self.rds_client: RDSClient = session.client('rds')
 
@@ -34,7 +34,7 @@ class RDS:
         # DBInstanceIdentifier (string)
         # Constraints:
         # If supplied, must match the identifier of an existing DBInstance.
-        snapshots = self.rds_client.describe_db_snapshots(SnapshotType="shared", IncludeShared=True)['DBSnapshots']
+        snapshots = call_with_retry(self.rds_client.describe_db_snapshots, SnapshotType="shared", IncludeShared=True)['DBSnapshots']
         # Filter for 'available' snapshots after retrieval because it could be that it conflicts with creating backup
         available_snapshots = [s for s in snapshots if s['Status'] == 'available' and s['DBInstanceIdentifier'] == snapshot_identifier]
         newest_snapshot = max(available_snapshots, key=lambda s: s['SnapshotCreateTime'])
@@ -51,10 +51,10 @@ class RDS:
             RDS.wait_snapshot(self.rds_client, newest_snapshot_copy['DBSnapshotIdentifier'], message="Waiting for RDS snapshot copy")
         except self.rds_client.exceptions.DBSnapshotAlreadyExistsFault:
             Logger.info("RDS Snapshot local copy already exists -- skipping")
-            newest_snapshot_copy = self.rds_client.describe_db_snapshots(DBInstanceIdentifier=snapshot_identifier, SnapshotType="manual")['DBSnapshots'][0]
+            newest_snapshot_copy = call_with_retry(self.rds_client.describe_db_snapshots, DBInstanceIdentifier=snapshot_identifier, SnapshotType="manual")['DBSnapshots'][0]
 
         # little hack, we take data from current instance and copy most configuration to the anonymization
-        current_instance = self.rds_client.describe_db_instances(DBInstanceIdentifier=config_from_db_identifier)['DBInstances'][0]
+        current_instance = call_with_retry(self.rds_client.describe_db_instances, DBInstanceIdentifier=config_from_db_identifier)['DBInstances'][0]
         try:
             self.rds_client.restore_db_instance_from_db_snapshot(
                 DBInstanceIdentifier=target_db_identifier,
@@ -64,7 +64,7 @@ class RDS:
             )
         except self.rds_client.exceptions.DBInstanceAlreadyExistsFault:
             Logger.info("RDS Instance already exists -- using it")
-            instance = self.rds_client.describe_db_instances(DBInstanceIdentifier=target_db_identifier)
+            instance = call_with_retry(self.rds_client.describe_db_instances, DBInstanceIdentifier=target_db_identifier)
             return instance['DBInstances'][0]['Endpoint']['Address']
         instance = RDS.wait_db(self.rds_client, target_db_identifier)
         return instance['DBInstances'][0]['Endpoint']['Address']
@@ -82,7 +82,8 @@ class RDS:
 
     @staticmethod
     def delete_old_snapshots(client, snapshot_identifier):
-        snapshots = client.describe_db_snapshots(
+        snapshots = call_with_retry(
+            client.describe_db_snapshots,
             DBInstanceIdentifier=snapshot_identifier,
             SnapshotType='manual'
         )['DBSnapshots']
@@ -96,34 +97,19 @@ class RDS:
                     Logger.info(f"Deleted old snapshot {snapshot_name}")
 
     @staticmethod
-    def wait_db(client, identifier, message="Waiting for RDS instance to be stable"):
-        sleep_time = 5
-        good_statuses = ['available', 'applying']
-        with click.progressbar(range(1, 300), label=message) as bar:
-            for x in bar:
-                # try after 2 mins, no need to try before that
-                if x > (60 / sleep_time):
-                    anonymized_instance = client.describe_db_instances(DBInstanceIdentifier=identifier)
-                    if anonymized_instance['DBInstances'][0]['DBInstanceStatus'] in good_statuses:
-                        return anonymized_instance
-                time.sleep(sleep_time)
-            else:
-                raise RDSException(f"The instance {identifier} is not in status 'available'")
+    def wait_db(client, identifier, message="Waiting for RDS instance to be stable", deadline=60 * 60):
+        try:
+            return waiters.wait_db(client, identifier, message, deadline)
+        except waiters.WaiterError as e:
+            raise RDSException(str(e)) from e
 
     @staticmethod
-    def wait_snapshot(client, identifier, message="Waiting for RDS snapshot to be available"):
-        sleep_time = 5
-        good_statuses = ['available']
-        with click.progressbar(range(1, 300), label=message) as bar:
-            for x in bar:
-                # try after 2 mins, no need to try before that
-                if x > (60 / sleep_time):
-                    anonymized_snapshot = client.describe_db_snapshots(DBSnapshotIdentifier=identifier)
-                    if anonymized_snapshot['DBSnapshots'][0]['Status'] in good_statuses:
-                        return anonymized_snapshot
-                time.sleep(sleep_time)
-            else:
-                raise RDSException(f"The snapshot {identifier} has timeouted to be stable")
+    def wait_snapshot(client, identifier, message="Waiting for RDS snapshot to be available", deadline=None):
+        # Without a deadline, it is derived from the snapshot size
+        try:
+            return waiters.wait_snapshot(client, identifier, message, deadline)
+        except waiters.WaiterError as e:
+            raise RDSException(str(e)) from e
 
 
 class RDSException(Exception):
@@ -8,85 +8,120 @@ Major changes:
 1. Added check for last update date of shared snapshot and local copy.
 2. Local copy is used until shared snapshot is updated.
 3. If shared snapshot is updated, old local copy is deleted and new one is created.
+4. Local copies are tagged with the shared snapshot they were made from and have unique,
+   versioned names; superseded copies are evicted least recently used first (copy_cache.py).
 
 These changes ensure that local copy is used until shared snapshot is updated,
 which minimizes unnecessary copies and speeds up restore process.
 '''
-import time
-from datetime import datetime, timedelta
 from typing import TYPE_CHECKING
-import boto3
-import click
 import logging
 
+import waiters
+from aio import restore_parameters
+from copy_cache import CopyCache
+from inventory import SnapshotInventory
+from waiters import call_with_retry
+from warm_pool import CLAIMED_TAG, RETIRE, RETURN, WarmPool, tags
+
 if TYPE_CHECKING:
     from mypy_boto3_rds import RDSClient
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured by the entry points (main.py, pipeline.py), not on import
 logger = logging.getLogger(__name__)
 
 class RDS:
     RDS_KMS = "arn:aws:kms:eu-central-1:123456789012:alias/shared_kms"
 
-    def __init__(self, aws_profile_name=None):
+    def __init__(self, aws_profile_name=None, tracer=None):
+        # boto3 takes a noticeable part of a second to import, only pay for it when a client is made
+        import boto3
+
         session = boto3.session.Session(profile_name=aws_profile_name)
         self.rds_client: RDSClient = session.client('rds')
-
-    def restore_instance_from_shared(self, snapshot_identifier, target_db_identifier, config_from_db_identifier) -> str:
+        # tracing.Tracer for the waiter polls, or None
+        self.tracer = tracer
+        # Shared by every restore made through this object
+        self.inventory = SnapshotInventory(self.rds_client)
+        self.copy_cache = CopyCache(self.rds_client, self.inventory, RDS.RDS_KMS, self.wait_snapshot)
+        # Shared snapshot identifier -> WarmPool, see enable_warm_pool()
+        self.warm_pools = {}
+
+    def enable_warm_pool(self, snapshot_identifier, config_from_db_identifier, size=1, release_policy=RETIRE):
+        # Keep `size` instances restored from the current local copy of this snapshot ready to hand out
+        pool = self.warm_pools[snapshot_identifier] = WarmPool(
+            self, snapshot_identifier, config_from_db_identifier, size, release_policy,
+        )
+        copy = self.local_copy(snapshot_identifier)
+        pool.sync(copy)
+        pool.refill(copy)
+        return pool
+
+    def restore_instance_from_shared(self, snapshot_identifier, target_db_identifier, config_from_db_identifier, wait=True) -> str:
         logger.info(f"Restoring RDS instance from snapshot '{snapshot_identifier}'")
-        
+        newest_snapshot_copy = self.local_copy(snapshot_identifier)
+        pool = self.warm_pools.get(snapshot_identifier)
+        if pool is not None and pool.config_from_db_identifier != config_from_db_identifier:
+            # Warm instances have the subnet group and class of the pool's config instance, not of this one
+            logger.info(f"Warm pool of '{snapshot_identifier}' is configured from '{pool.config_from_db_identifier}' -- restoring a new instance")
+            pool = None
+        if pool is None:
+            return self.restore_from_copy(newest_snapshot_copy, target_db_identifier, config_from_db_identifier, wait=wait)
+
+        # A new shared snapshot makes the pooled instances stale
+        pool.sync(newest_snapshot_copy)
+        try:
+            endpoint = pool.claim(target_db_identifier, newest_snapshot_copy)
+            if endpoint is None:
+                logger.info("No warm instance ready -- restoring a new one")
+                endpoint = self.restore_from_copy(newest_snapshot_copy, target_db_identifier, config_from_db_identifier, wait=wait)
+        finally:
+            pool.refill(newest_snapshot_copy)
+        return endpoint
+
+    def local_copy(self, snapshot_identifier) -> dict:
         # Getting a shared snapshot
-        snapshots = self.rds_client.describe_db_snapshots(SnapshotType="shared", IncludeShared=True)['DBSnapshots']
-        available_snapshots = [s for s in snapshots if s['Status'] == 'available' and s['DBInstanceIdentifier'] == snapshot_identifier]
-        newest_snapshot = max(available_snapshots, key=lambda s: s['SnapshotCreateTime'])
-
-        # Getting local snapshots
-        local_snapshots = self.rds_client.describe_db_snapshots(DBInstanceIdentifier=snapshot_identifier, SnapshotType="manual")['DBSnapshots']
-        if local_snapshots:
-            newest_local_snapshot = max(local_snapshots, key=lambda s: s['SnapshotCreateTime'])
-            local_snapshot_time = newest_local_snapshot['SnapshotCreateTime']
-        else:
-            local_snapshot_time = None
-
-        # Shared snapshot creation time
-        shared_snapshot_time = newest_snapshot['SnapshotCreateTime']
-
-        # Checking if the local copy needs to be updated
-        if local_snapshot_time is None or shared_snapshot_time > local_snapshot_time:
-            logger.info("Shared snapshot is newer than local snapshot or local snapshot does not exist. Creating a new local copy.")
-            self.delete_old_snapshots(self.rds_client, snapshot_identifier)
-            try:
-                newest_snapshot_copy = self.rds_client.copy_db_snapshot(
-                    SourceDBSnapshotIdentifier=newest_snapshot['DBSnapshotArn'],
-                    TargetDBSnapshotIdentifier=f"{newest_snapshot['DBInstanceIdentifier']}-copy",
-                    KmsKeyId=RDS.RDS_KMS,
-                )['DBSnapshot']
-                self.wait_snapshot(self.rds_client, newest_snapshot_copy['DBSnapshotIdentifier'], message="Waiting for RDS snapshot copy")
-            except self.rds_client.exceptions.DBSnapshotAlreadyExistsFault:
-                logger.info("RDS Snapshot local copy already exists -- skipping")
-                newest_snapshot_copy = self.rds_client.describe_db_snapshots(DBInstanceIdentifier=snapshot_identifier, SnapshotType="manual")['DBSnapshots'][0]
-        else:
-            logger.info("Using existing local snapshot copy.")
-            newest_snapshot_copy = newest_local_snapshot
-
+        newest_snapshot = self.inventory.newest_shared(snapshot_identifier)
+        if newest_snapshot is None:
+            raise RDSException(f"No available shared snapshot of '{snapshot_identifier}'")
+        # The local copy made from exactly this shared snapshot, copied now if there is none yet
+        return self.copy_cache.get_or_copy(newest_snapshot)
+
+    def restore_from_copy(self, newest_snapshot_copy, target_db_identifier, config_from_db_identifier, tags=None, wait=True) -> str:
+        # With wait=False only the restore is started, and the endpoint is returned if RDS already has one
         # Get the current configuration of the RDS instance. (Restore RDS instance)
-        current_instance = self.rds_client.describe_db_instances(DBInstanceIdentifier=config_from_db_identifier)['DBInstances'][0]
+        current_instance = call_with_retry(self.rds_client.describe_db_instances, DBInstanceIdentifier=config_from_db_identifier)['DBInstances'][0]
         try:
             self.rds_client.restore_db_instance_from_db_snapshot(
-                DBInstanceIdentifier=target_db_identifier,
-                DBSnapshotIdentifier=newest_snapshot_copy['DBSnapshotIdentifier'],
-                DBSubnetGroupName=current_instance['DBSubnetGroup']['DBSubnetGroupName'],
-                DBInstanceClass=current_instance['DBInstanceClass'],
+                **restore_parameters(current_instance, newest_snapshot_copy['DBSnapshotIdentifier'], target_db_identifier, tags)
             )
         except self.rds_client.exceptions.DBInstanceAlreadyExistsFault:
             logger.info("RDS Instance already exists -- using it")
-            instance = self.rds_client.describe_db_instances(DBInstanceIdentifier=target_db_identifier)
+            instance = call_with_retry(self.rds_client.describe_db_instances, DBInstanceIdentifier=target_db_identifier)
+            if not wait:
+                return instance['DBInstances'][0].get('Endpoint', {}).get('Address')
             return instance['DBInstances'][0]['Endpoint']['Address']
+        if not wait:
+            return None
         instance = self.wait_db(self.rds_client, target_db_identifier)
         return instance['DBInstances'][0]['Endpoint']['Address']
 
+    def create_snapshot(self, db_identifier, snapshot_identifier) -> dict:
+        # Snapshot of an instance, e.g. of the anonymized result before it is destroyed
+        logger.info(f"Creating RDS snapshot '{snapshot_identifier}' of '{db_identifier}'")
+        try:
+            self.rds_client.create_db_snapshot(
+                DBSnapshotIdentifier=snapshot_identifier,
+                DBInstanceIdentifier=db_identifier,
+            )
+        except self.rds_client.exceptions.DBSnapshotAlreadyExistsFault:
+            logger.info(f"RDS snapshot {snapshot_identifier} already exists -- using it")
+        return self.wait_snapshot(self.rds_client, snapshot_identifier)['DBSnapshots'][0]
+
     def destroy_instance(self, db_identifier):
+        # Instances handed out by a warm pool may go back to it, if the pool's release policy says so
+        if any(pool.release_policy == RETURN for pool in self.warm_pools.values()) and self._return_to_pool(db_identifier):
+            return
         logger.info(f"Destroying RDS instance '{db_identifier}'")
         try:
             self.rds_client.delete_db_instance(
@@ -97,47 +132,31 @@ class RDS:
         except self.rds_client.exceptions.DBInstanceNotFoundFault:
             logger.info(f"RDS instance with identifier {db_identifier} is not found -- nothing to delete")
 
-    @staticmethod
-    def delete_old_snapshots(client, snapshot_identifier):
-        snapshots = client.describe_db_snapshots(
-            DBInstanceIdentifier=snapshot_identifier,
-            SnapshotType='manual'
-        )['DBSnapshots']
-        for snapshot in snapshots:
-            if snapshot_time := snapshot.get('SnapshotCreateTime', None):
-                retention_period = timedelta(days=7)
-                if datetime.now(snapshot_time.tzinfo) - snapshot_time > retention_period:
-                    snapshot_name = snapshot['DBSnapshotIdentifier']
-                    client.delete_db_snapshot(DBSnapshotIdentifier=snapshot_name)
-                    logger.info(f"Deleted old snapshot {snapshot_name}")
-
-    @staticmethod
-    def wait_db(client, identifier, message="Waiting for RDS instance to be stable"):
-        sleep_time = 5
-        good_statuses = ['available', 'applying']
-        with click.progressbar(range(1, 300), label=message) as bar:
-            for x in bar:
-                if x > (60 / sleep_time):
-                    anonymized_instance = client.describe_db_instances(DBInstanceIdentifier=identifier)
-                    if anonymized_instance['DBInstances'][0]['DBInstanceStatus'] in good_statuses:
-                        return anonymized_instance
-                time.sleep(sleep_time)
-            else:
-                raise RDSException(f"The instance {identifier} is not in status 'available'")
-
-    @staticmethod
-    def wait_snapshot(client, identifier, message="Waiting for RDS snapshot to be available"):
-        sleep_time = 5
-        good_statuses = ['available']
-        with click.progressbar(range(1, 300), label=message) as bar:
-            for x in bar:
-                if x > (60 / sleep_time):
-                    anonymized_snapshot = client.describe_db_snapshots(DBSnapshotIdentifier=identifier)
-                    if anonymized_snapshot['DBSnapshots'][0]['Status'] in good_statuses:
-                        return anonymized_snapshot
-                time.sleep(sleep_time)
-            else:
-                raise RDSException(f"The snapshot {identifier} has timed out to be stable")
+    def _return_to_pool(self, db_identifier):
+        try:
+            instance = call_with_retry(self.rds_client.describe_db_instances, DBInstanceIdentifier=db_identifier)['DBInstances'][0]
+        except self.rds_client.exceptions.DBInstanceNotFoundFault:
+            return False
+        pool = self.warm_pools.get(tags(instance).get(CLAIMED_TAG))
+        if pool is None or pool.release_policy != RETURN:
+            return False
+        # Only the existing copy of the newest shared snapshot: a release never starts a copy
+        shared = self.inventory.newest_shared(pool.snapshot_identifier)
+        copy = self.copy_cache.find(shared) if shared is not None else None
+        return copy is not None and pool.release(instance, copy)
+
+    def wait_db(self, client, identifier, message="Waiting for RDS instance to be stable", deadline=60 * 60):
+        try:
+            return waiters.wait_db(client, identifier, message, deadline, tracer=self.tracer)
+        except waiters.WaiterError as e:
+            raise RDSException(str(e)) from e
+
+    def wait_snapshot(self, client, identifier, message="Waiting for RDS snapshot to be available", deadline=None):
+        # Without a deadline, it is derived from the snapshot size
+        try:
+            return waiters.wait_snapshot(client, identifier, message, deadline, tracer=self.tracer)
+        except waiters.WaiterError as e:
+            raise RDSException(str(e)) from e
 
 
 class RDSException(Exception):
@@ -0,0 +1,150 @@
+# test_aio.py
+'''
+AsyncRDS, and the synchronous RDS of rds_new.py next to it, against moto in server mode, offline.
+
+    pip install aiobotocore boto3 'moto[server]' pytest
+    python -m pytest -q test_aio.py
+
+moto finishes copies and restores at once, so the waiters return on their first poll.
+'''
+
+import asyncio
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('aiobotocore')
+boto3 = pytest.importorskip('boto3')
+moto_server = pytest.importorskip('moto.server')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aio import AsyncRDS
+from rds_new import RDS
+
+REGION = 'eu-central-1'
+
+
+@pytest.fixture(scope='module')
+def endpoint_url():
+    # Fake credentials, so nothing here can ever reach a real account
+    environment = {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing', 'AWS_DEFAULT_REGION': REGION}
+    with mock.patch.dict(os.environ, environment):
+        os.environ.pop('AWS_PROFILE', None)
+        server = moto_server.ThreadedMotoServer(port=0, verbose=False)
+        server.start()
+        host, port = server.get_host_and_port()
+        try:
+            yield f'http://{host}:{port}'
+        finally:
+            server.stop()
+
+
+def run(endpoint_url, test, **options):
+    async def main():
+        async with AsyncRDS(region_name=REGION, endpoint_url=endpoint_url, **options) as rds:
+            return await test(rds)
+
+    return asyncio.run(main())
+
+
+async def create_source(rds, name):
+    # An instance to restore configuration from, and a snapshot of it
+    async with rds.session.create_client('ec2', region_name=REGION, endpoint_url=rds.endpoint_url) as ec2:
+        vpc = (await ec2.create_vpc(CidrBlock='10.0.0.0/16'))['Vpc']['VpcId']
+        subnet = (await ec2.create_subnet(VpcId=vpc, CidrBlock='10.0.0.0/24'))['Subnet']['SubnetId']
+    await rds.rds_client.create_db_subnet_group(DBSubnetGroupName=name, DBSubnetGroupDescription=name, SubnetIds=[subnet])
+    await rds.rds_client.create_db_instance(
+        DBInstanceIdentifier=name, DBInstanceClass='db.t3.micro', Engine='postgres', AllocatedStorage=20,
+        MasterUsername='test', MasterUserPassword='testpassword', DBSubnetGroupName=name,
+    )
+    return await rds.create_snapshot(name, f'{name}-snapshot')
+
+
+def test_copy_restore_snapshot_and_delete(endpoint_url):
+    async def test(rds):
+        source = await create_source(rds, 'source-a')
+        async with rds.session.create_client('kms', region_name=REGION, endpoint_url=rds.endpoint_url) as kms:
+            key = (await kms.create_key())['KeyMetadata']['KeyId']
+        copy = await rds.copy_snapshot(source['DBSnapshotArn'], 'source-a-copy', key, tags=[{'Key': 'k', 'Value': 'v'}])
+        copied = (await rds.wait_snapshot(copy['DBSnapshotIdentifier']))['DBSnapshots'][0]
+        assert copied['Status'] == 'available'
+
+        endpoint = await rds.restore_instance('source-a-copy', 'target-a', 'source-a')
+        assert endpoint.startswith('target-a.')
+        # Restoring an existing instance again reuses it
+        assert await rds.restore_instance('source-a-copy', 'target-a', 'source-a', wait=False) == endpoint
+
+        output = await rds.create_snapshot('target-a', 'target-a-output')
+        assert output['Status'] == 'available'
+        # Already existing, so it is only waited for
+        assert (await rds.create_snapshot('target-a', 'target-a-output'))['DBSnapshotIdentifier'] == 'target-a-output'
+
+        await rds.delete_instance('target-a')
+        await rds.delete_instance('target-a')
+        await rds.delete_snapshot('target-a-output')
+        await rds.delete_snapshot('target-a-output')
+        remaining = await rds.describe_snapshots(SnapshotType='manual')
+        assert 'target-a-output' not in {s['DBSnapshotIdentifier'] for s in remaining}
+
+    run(endpoint_url, test)
+
+
+def test_many_restores_share_one_loop(endpoint_url):
+    async def test(rds):
+        source = await create_source(rds, 'source-b')
+        in_flight = peak = 0
+
+        # API calls on the wire at once, which the shared limit keeps at max_api_calls
+        def before_call(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+
+        def after_call(**kwargs):
+            nonlocal in_flight
+            in_flight -= 1
+
+        rds.rds_client.meta.events.register('before-call.rds', before_call)
+        rds.rds_client.meta.events.register('after-call.rds', after_call)
+        targets = [f'target-b-{number}' for number in range(12)]
+        endpoints = await asyncio.gather(*(
+            rds.restore_instance(source['DBSnapshotIdentifier'], target, 'source-b') for target in targets
+        ))
+        assert [endpoint.split('.')[0] for endpoint in endpoints] == targets
+        assert 1 < peak <= 4
+        await asyncio.gather(*(rds.delete_instance(target) for target in targets))
+
+    run(endpoint_url, test, max_api_calls=4)
+
+
+def test_sync_restore_snapshot_and_delete(endpoint_url):
+    # The same steps through boto3, which finds the server through AWS_ENDPOINT_URL
+    with mock.patch.dict(os.environ, {'AWS_ENDPOINT_URL': endpoint_url}):
+        rds = RDS()
+        ec2 = boto3.session.Session().client('ec2')
+        vpc = ec2.create_vpc(CidrBlock='10.1.0.0/16')['Vpc']['VpcId']
+        subnet = ec2.create_subnet(VpcId=vpc, CidrBlock='10.1.0.0/24')['Subnet']['SubnetId']
+        rds.rds_client.create_db_subnet_group(DBSubnetGroupName='source-c', DBSubnetGroupDescription='source-c', SubnetIds=[subnet])
+        rds.rds_client.create_db_instance(
+            DBInstanceIdentifier='source-c', DBInstanceClass='db.t3.micro', Engine='postgres', AllocatedStorage=20,
+            MasterUsername='test', MasterUserPassword='testpassword', DBSubnetGroupName='source-c',
+        )
+        source = rds.create_snapshot('source-c', 'source-c-snapshot')
+        assert source['Status'] == 'available'
+
+        endpoint = rds.restore_from_copy(source, 'target-c', 'source-c', tags=[{'Key': 'k', 'Value': 'v'}])
+        assert endpoint.startswith('target-c.')
+        assert rds.restore_from_copy(source, 'target-c', 'source-c', wait=False) == endpoint
+        assert rds.wait_db(rds.rds_client, 'target-c')['DBInstances'][0]['DBInstanceStatus'] == 'available'
+
+        output = rds.create_snapshot('target-c', 'target-c-output')
+        assert output['Status'] == 'available'
+        assert rds.create_snapshot('target-c', 'target-c-output')['DBSnapshotIdentifier'] == 'target-c-output'
+
+        rds.destroy_instance('target-c')
+        rds.destroy_instance('target-c')
+        instances = rds.rds_client.describe_db_instances()['DBInstances']
+        assert 'target-c' not in {instance['DBInstanceIdentifier'] for instance in instances}
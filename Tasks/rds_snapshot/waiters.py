@@ -0,0 +1,206 @@
+# waiters.py
+'''
+Adaptive waiting for RDS snapshots and instances.
+
+The first describe happens right away, so a resource that is already done costs one call.
+After that, polls back off exponentially with jitter. For snapshots, the first delays are
+predicted from AllocatedStorage and PercentProgress, and the deadline scales with the snapshot
+size unless given explicitly. Every describe call goes through call_with_retry(), which
+backs off on API throttling instead of failing the wait.
+sleep and clock can be swapped out, so waits can be driven by botocore's Stubber or moto
+without really sleeping.
+'''
+
+import asyncio
+import logging
+import random
+import time
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERRORS = {'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException'}
+MAX_RETRIES = 8
+
+# Rough copy speed used to predict a snapshot copy before it reports any progress
+SECONDS_PER_GIB = 6
+SNAPSHOT_READY = {'available'}
+SNAPSHOT_FAILED = {'failed', 'error', 'deleted'}
+INSTANCE_READY = {'available', 'applying'}
+INSTANCE_FAILED = {'failed', 'incompatible-restore', 'incompatible-parameters', 'incompatible-network', 'storage-full', 'deleted'}
+
+
+class WaiterError(Exception):
+    pass
+
+
+def backoff(attempt, base=1.0, cap=30.0):
+    # "Full jitter": anywhere between 0 and the exponential delay
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def error_code(e):
+    # The API error code of a botocore ClientError; matched on its `response` rather than
+    # the class, so botocore is only imported by the code that makes the clients
+    response = getattr(e, 'response', None)
+    return response.get('Error', {}).get('Code') if isinstance(response, dict) else None
+
+
+def call_with_retry(operation, max_retries=MAX_RETRIES, sleep=time.sleep, **kwargs):
+    for attempt in range(max_retries + 1):
+        try:
+            return operation(**kwargs)
+        except Exception as e:
+            if error_code(e) not in THROTTLING_ERRORS or attempt == max_retries:
+                raise
+            delay = backoff(attempt)
+            logger.info(f"{operation.__name__} throttled, retrying in {delay:.1f}s")
+            sleep(delay)
+
+
+async def call_with_retry_async(operation, max_retries=MAX_RETRIES, sleep=asyncio.sleep, **kwargs):
+    for attempt in range(max_retries + 1):
+        try:
+            return await operation(**kwargs)
+        except Exception as e:
+            if error_code(e) not in THROTTLING_ERRORS or attempt == max_retries:
+                raise
+            delay = backoff(attempt)
+            logger.info(f"{operation.__name__} throttled, retrying in {delay:.1f}s")
+            await sleep(delay)
+
+
+class Waiter:
+    def __init__(self, min_delay=5.0, max_delay=60.0, factor=1.5, jitter=0.2, sleep=time.sleep, clock=time.monotonic,
+                 async_sleep=asyncio.sleep, tracer=None):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.sleep = sleep
+        self.async_sleep = async_sleep
+        self.clock = clock
+        # tracing.Tracer, or None; each poll and each sleep then gets a span
+        self.tracer = tracer
+
+    def _jittered(self, delay):
+        # Clamped after the jitter, so no poll is ever further apart than max_delay
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return min(max(delay, self.min_delay), self.max_delay)
+
+    def wait(self, describe, status_of, ready, failed, deadline, message, predict=None):
+        '''
+        Polls describe() until status_of(response) is in `ready`. deadline is in seconds, or a
+        function of the first response. predict(response, history), if given, returns the
+        expected seconds left, used to size the next delay.
+        '''
+        polls = self._polls(status_of, ready, failed, deadline, message, predict)
+        next(polls)
+        while True:
+            with self._span('waiter.poll', message):
+                response = describe()
+            try:
+                delay = polls.send(response)
+            except StopIteration as done:
+                return done.value
+            with self._span('waiter.sleep', message, status=status_of(response)):
+                self.sleep(delay)
+
+    async def wait_async(self, describe, status_of, ready, failed, deadline, message, predict=None):
+        # Same as wait(), for a coroutine describe(), so one event loop can follow many resources
+        polls = self._polls(status_of, ready, failed, deadline, message, predict)
+        next(polls)
+        while True:
+            with self._span('waiter.poll', message):
+                response = await describe()
+            try:
+                delay = polls.send(response)
+            except StopIteration as done:
+                return done.value
+            with self._span('waiter.sleep', message, status=status_of(response)):
+                await self.async_sleep(delay)
+
+    def _span(self, name, message, **args):
+        return self.tracer.span(name, 'waiter', waiting_for=message, **args) if self.tracer else nullcontext()
+
+    def _polls(self, status_of, ready, failed, deadline, message, predict):
+        # Gets each describe response sent in and yields the delay before the next one;
+        # returns the response once the resource is ready
+        logger.info(message)
+        started = self.clock()
+        delay = self.min_delay
+        history = []
+        response = yield
+        while True:
+            status = status_of(response)
+            elapsed = self.clock() - started
+            history.append((elapsed, response))
+            if callable(deadline):
+                deadline = deadline(response)
+            if status in ready:
+                logger.info(f"{message}: done after {elapsed:.0f}s")
+                return response
+            if status in failed:
+                raise WaiterError(f"{message}: status is '{status}'")
+            if elapsed >= deadline:
+                raise WaiterError(f"{message}: still '{status}' after {elapsed:.0f}s")
+            expected = predict(response, history) if predict else None
+            if expected is not None:
+                # Poll about halfway through the expected remaining time, so we close in on it
+                delay = expected / 2
+            else:
+                delay = delay * self.factor if len(history) > 1 else self.min_delay
+            delay = min(self._jittered(delay), max(deadline - elapsed, 0))
+            logger.debug(f"{message}: '{status}', next poll in {delay:.0f}s")
+            response = yield delay
+
+
+def predict_snapshot(response, history):
+    snapshot = response['DBSnapshots'][0]
+    progress = snapshot.get('PercentProgress', 0)
+    if progress <= 0:
+        return snapshot.get('AllocatedStorage', 0) * SECONDS_PER_GIB
+    # Extrapolate from the progress made since the first poll that reported any
+    for elapsed, earlier in history:
+        earlier_progress = earlier['DBSnapshots'][0].get('PercentProgress', 0)
+        if 0 < earlier_progress < progress:
+            rate = (progress - earlier_progress) / (history[-1][0] - elapsed)
+            return (100 - progress) / rate
+    return snapshot.get('AllocatedStorage', 0) * SECONDS_PER_GIB * (100 - progress) / 100
+
+
+def snapshot_deadline(response):
+    # Generous allowance on top of the size-based prediction; huge copies take hours
+    return max(30 * 60, 4 * response['DBSnapshots'][0].get('AllocatedStorage', 0) * SECONDS_PER_GIB)
+
+
+def snapshot_status(response):
+    return response['DBSnapshots'][0]['Status']
+
+
+def instance_status(response):
+    return response['DBInstances'][0]['DBInstanceStatus']
+
+
+def wait_snapshot(client, identifier, message="Waiting for RDS snapshot to be available", deadline=None, waiter=None, tracer=None):
+    waiter = waiter or Waiter(tracer=tracer)
+
+    def describe():
+        return call_with_retry(client.describe_db_snapshots, sleep=waiter.sleep, DBSnapshotIdentifier=identifier)
+
+    return waiter.wait(
+        describe, snapshot_status, SNAPSHOT_READY, SNAPSHOT_FAILED,
+        deadline or snapshot_deadline, f"{message} ({identifier})", predict=predict_snapshot,
+    )
+
+
+def wait_db(client, identifier, message="Waiting for RDS instance to be stable", deadline=60 * 60, waiter=None, tracer=None):
+    waiter = waiter or Waiter(min_delay=15.0, tracer=tracer)
+
+    def describe():
+        return call_with_retry(client.describe_db_instances, sleep=waiter.sleep, DBInstanceIdentifier=identifier)
+
+    return waiter.wait(
+        describe, instance_status, INSTANCE_READY, INSTANCE_FAILED,
+        deadline, f"{message} ({identifier})",
+    )
@@ -0,0 +1,165 @@
+# warm_pool.py
+'''
+Warm standby pool of instances already restored from the current local copy.
+
+Restoring an instance is the slowest step of the pipeline, so the pool keeps `size` spare
+instances restored ahead of time. A restore request claims one of them: it is taken out of
+the pool, renamed to the requested identifier and handed over, while a replacement is
+restored in a background thread. Pool membership lives in RDS tags, so it survives the
+process. When the shared snapshot changes, members restored from an older local copy are
+retired and the pool is refilled from the new one. Members have the subnet group and class
+of the pool's config_from_db_identifier, so only restores asking for that one are served.
+'''
+
+import logging
+import threading
+import uuid
+
+from waiters import INSTANCE_FAILED, Waiter, call_with_retry
+
+logger = logging.getLogger(__name__)
+
+POOL_TAG = 'warm-pool:snapshot'
+SOURCE_COPY_TAG = 'warm-pool:source-copy'
+CLAIMED_TAG = 'warm-pool:claimed-from'
+
+# What destroy_instance does with an instance that came from the pool
+RETIRE = 'retire'
+RETURN = 'return'
+
+
+def tags(instance):
+    return {tag['Key']: tag['Value'] for tag in instance.get('TagList', [])}
+
+
+class WarmPool:
+    def __init__(self, rds, snapshot_identifier, config_from_db_identifier, size=1, release_policy=RETIRE):
+        self.rds = rds
+        self.client = rds.rds_client
+        self.snapshot_identifier = snapshot_identifier
+        self.config_from_db_identifier = config_from_db_identifier
+        self.size = size
+        # RETURN puts a released instance back in the pool; only safe when users don't change its data
+        self.release_policy = release_policy
+        self._lock = threading.Lock()
+        # Identifiers of members being restored by this process; they show up in members()
+        # once RDS knows them, and are counted only once until the restore is done
+        self._pending = set()
+        self._threads = []
+
+    def members(self):
+        # Instances of this pool; ones still restoring count too, so they are not started twice
+        paginator = self.client.get_paginator('describe_db_instances')
+        return [
+            instance
+            for page in paginator.paginate()
+            for instance in page['DBInstances']
+            if tags(instance).get(POOL_TAG) == self.snapshot_identifier and instance['DBInstanceStatus'] != 'deleting'
+        ]
+
+    def _count(self):
+        return len({instance['DBInstanceIdentifier'] for instance in self.members()} | self._pending)
+
+    def sync(self, copy):
+        # Retire members restored from an older local copy
+        for instance in self.members():
+            if tags(instance).get(SOURCE_COPY_TAG) != copy['DBSnapshotIdentifier']:
+                logger.info(f"Retiring warm instance {instance['DBInstanceIdentifier']}, its snapshot was superseded")
+                self._delete(instance['DBInstanceIdentifier'])
+
+    def claim(self, target_db_identifier, copy):
+        with self._lock:
+            ready = [
+                instance for instance in self.members()
+                if instance['DBInstanceStatus'] == 'available'
+                and tags(instance).get(SOURCE_COPY_TAG) == copy['DBSnapshotIdentifier']
+            ]
+            if not ready:
+                return None
+            instance = ready[0]
+            arn = instance['DBInstanceArn']
+            # Leave the pool first so no other claim can pick the same instance
+            self.client.remove_tags_from_resource(ResourceName=arn, TagKeys=[POOL_TAG])
+        self.client.add_tags_to_resource(ResourceName=arn, Tags=[{'Key': CLAIMED_TAG, 'Value': self.snapshot_identifier}])
+        logger.info(f"Handing warm instance {instance['DBInstanceIdentifier']} over as {target_db_identifier}")
+        self.client.modify_db_instance(
+            DBInstanceIdentifier=instance['DBInstanceIdentifier'],
+            NewDBInstanceIdentifier=target_db_identifier,
+            ApplyImmediately=True,
+        )
+        # Renaming changes the endpoint, wait until the new one is in place.
+        # The new name is unknown to RDS until the rename has started
+        def describe():
+            try:
+                return call_with_retry(self.client.describe_db_instances, DBInstanceIdentifier=target_db_identifier)
+            except self.client.exceptions.DBInstanceNotFoundFault:
+                return {'DBInstances': [{'DBInstanceStatus': 'renaming'}]}
+
+        renamed = Waiter(min_delay=5.0, max_delay=15.0, tracer=self.rds.tracer).wait(
+            describe, lambda r: r['DBInstances'][0]['DBInstanceStatus'], {'available'}, INSTANCE_FAILED,
+            15 * 60, f"Waiting for warm instance rename ({target_db_identifier})",
+        )
+        return renamed['DBInstances'][0]['Endpoint']['Address']
+
+    def refill(self, copy):
+        # Restores the missing members in background threads and returns right away
+        with self._lock:
+            identifiers = [
+                f"{self.snapshot_identifier}-warm-{uuid.uuid4().hex[:8]}" for _ in range(self.size - self._count())
+            ]
+            self._pending.update(identifiers)
+        for identifier in identifiers:
+            thread = threading.Thread(target=self._restore_member, args=(copy, identifier), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _restore_member(self, copy, identifier):
+        try:
+            self.rds.restore_from_copy(copy, identifier, self.config_from_db_identifier, tags=[
+                {'Key': POOL_TAG, 'Value': self.snapshot_identifier},
+                {'Key': SOURCE_COPY_TAG, 'Value': copy['DBSnapshotIdentifier']},
+            ])
+            logger.info(f"Warm instance {identifier} is ready")
+        except Exception as e:
+            logger.error(f"Restoring warm instance {identifier} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(identifier)
+
+    def release(self, instance, copy):
+        '''
+        Puts a claimed instance back in the pool under a fresh pool name.
+        Returns False when it should be retired instead: the policy says so, its local copy
+        was superseded, or the pool is already full.
+        '''
+        if self.release_policy != RETURN or tags(instance).get(SOURCE_COPY_TAG) != copy['DBSnapshotIdentifier']:
+            return False
+        with self._lock:
+            if self._count() >= self.size:
+                return False
+            arn = instance['DBInstanceArn']
+            self.client.remove_tags_from_resource(ResourceName=arn, TagKeys=[CLAIMED_TAG])
+            self.client.modify_db_instance(
+                DBInstanceIdentifier=instance['DBInstanceIdentifier'],
+                NewDBInstanceIdentifier=f"{self.snapshot_identifier}-warm-{uuid.uuid4().hex[:8]}",
+                ApplyImmediately=True,
+            )
+            self.client.add_tags_to_resource(ResourceName=arn, Tags=[{'Key': POOL_TAG, 'Value': self.snapshot_identifier}])
+        logger.info(f"Returned {instance['DBInstanceIdentifier']} to the warm pool")
+        return True
+
+    def _delete(self, db_identifier):
+        try:
+            call_with_retry(
+                self.client.delete_db_instance,
+                DBInstanceIdentifier=db_identifier,
+                SkipFinalSnapshot=True,
+                DeleteAutomatedBackups=True,
+            )
+        except (self.client.exceptions.DBInstanceNotFoundFault, self.client.exceptions.InvalidDBInstanceStateFault):
+            pass
+
+    def join(self, timeout=None):
+        # Wait for background refills, e.g. before a short-lived process exits
+        for thread in self._threads:
+            thread.join(timeout)
@@ -0,0 +1,204 @@
+# test_monitoring.py
+'''
+Alert state, metrics, the scheduler and the alert dispatcher, without the network.
+The dispatcher tests send to a local aiosmtpd server and are skipped without it.
+
+    pip install aiosmtpd pytest
+    python -m pytest -q test_monitoring.py
+'''
+
+import asyncio
+import email
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from monitoring import AlertDispatcher, Metrics, ProbeResult, Scheduler, Site, SiteStates, DOWN, UP
+
+URL = 'https://example.com'
+
+
+def probe_result(url=URL, status=200, total=0.1, error=None):
+    result = ProbeResult(url)
+    result.status, result.total, result.error = status, total, error
+    return result
+
+
+def test_down_is_alerted_once_and_recovery_after_threshold():
+    states = SiteStates(fail_threshold=3, recover_threshold=2, dedup_window=60)
+    assert [states.update(URL, False, now=t) for t in range(5)] == [None, None, 'down', None, None]
+    assert states.state(URL) == DOWN
+    assert [states.update(URL, True, now=t) for t in range(5, 7)] == [None, 'recovered']
+    assert states.state(URL) == UP
+
+
+def test_flapping_site_is_not_alerted_again_within_the_dedup_window():
+    states = SiteStates(fail_threshold=1, recover_threshold=1, dedup_window=60)
+    assert states.update(URL, False, now=0) == 'down'
+    assert states.update(URL, True, now=1) == 'recovered'
+    assert states.update(URL, False, now=2) is None
+    # Still down once the window has passed, so the suppressed alert goes out now
+    assert states.update(URL, False, now=61) == 'down'
+
+
+def test_slow_incident_escalates_to_down():
+    states = SiteStates(fail_threshold=2, dedup_window=60)
+    assert [states.update(URL, True, now=t, is_slow=True) for t in range(2)] == [None, 'slow']
+    assert [states.update(URL, False, now=t) for t in range(2, 4)] == [None, 'down']
+
+
+def test_snapshot_restores_the_incident(tmp_path):
+    path = str(tmp_path / 'state.json')
+    states = SiteStates(fail_threshold=2)
+    states.update(URL, False, now=0)
+    states.snapshot(path)
+
+    restored = SiteStates(fail_threshold=2)
+    assert restored.restore(path)
+    assert restored.update(URL, False, now=1) == 'down'
+    assert not SiteStates().restore(str(tmp_path / 'missing.json'))
+
+
+def test_metrics_quantiles_stay_within_a_bucket():
+    metrics = Metrics()
+    for i in range(1, 101):
+        metrics.observe(probe_result(total=i / 100))
+    metrics.observe(probe_result(status=None, total=5.0, error='TimeoutError'))
+    summary = metrics.summary()[URL]
+    assert summary['count'] == 100
+    assert summary['errors'] == {'TimeoutError': 1}
+    assert summary['statuses'] == {'200': 100}
+    assert abs(summary['p50'] - 0.5) <= 0.5 * 0.25
+    assert abs(summary['p99'] - 0.99) <= 0.99 * 0.25
+    assert metrics.quantile('https://unknown.example.com', 0.5) is None
+
+    text = metrics.to_prometheus()
+    assert f'monitoring_probe_duration_seconds_bucket{{url="{URL}",le="+Inf"}} 100' in text
+    assert f'monitoring_probe_errors_total{{url="{URL}",error="TimeoutError"}} 1' in text
+
+
+class FakeProber:
+    # Answers every probe after `delay` seconds, and records how many ran at once per site
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.running = {}
+        self.peak = {}
+
+    async def probe(self, url, timeout=None):
+        self.running[url] = self.running.get(url, 0) + 1
+        self.peak[url] = max(self.peak.get(url, 0), self.running[url])
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running[url] -= 1
+        return probe_result(url)
+
+
+def test_scheduler_checks_each_site_on_its_interval_without_piling_up():
+    fast, slow = 'https://fast.example.com', 'https://slow.example.com'
+    prober = FakeProber()
+    checked = []
+
+    async def main():
+        async def on_result(site, result):
+            checked.append(site.url)
+            if checked.count(fast) >= 10:
+                scheduler.stop()
+
+        scheduler = Scheduler(prober, [Site(fast, interval=0.01), Site(slow, interval=10)], on_result, jitter=0)
+        await asyncio.wait_for(scheduler.run(), 5)
+
+    asyncio.run(main())
+    assert checked.count(fast) == 10
+    assert checked.count(slow) <= 1
+
+    # A probe that outlasts its interval is skipped for that tick instead of started again
+    prober = FakeProber(delay=0.05)
+    checked = []
+
+    async def main_slow():
+        async def on_result(site, result):
+            checked.append(site.url)
+            if len(checked) >= 3:
+                scheduler.stop()
+
+        scheduler = Scheduler(prober, [Site(fast, interval=0.005)], on_result, jitter=0)
+        await asyncio.wait_for(scheduler.run(), 5)
+
+    asyncio.run(main_slow())
+    assert prober.peak[fast] == 1
+
+
+class Handler:
+    # Refuses the first `refuse` messages with a temporary failure, then accepts and keeps them
+    def __init__(self, refuse=0):
+        self.refuse = refuse
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.refuse:
+            self.refuse -= 1
+            return '451 Try again later'
+        self.messages.append(email.message_from_bytes(envelope.content))
+        return '250 OK'
+
+
+@pytest.fixture
+def smtp_server():
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+    servers = []
+
+    def start(handler):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        controller = controller_module.Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        servers.append(controller)
+        return port
+
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+def dispatch(port, alerts, **options):
+    async def main():
+        async with AlertDispatcher('ops@example.com', host='127.0.0.1', port=port, username=None,
+                                   from_addr='monitor@example.com', starttls=False, **options) as dispatcher:
+            for subject, message in alerts:
+                assert dispatcher.submit(message, subject=subject)
+        return dispatcher
+
+    return asyncio.run(main())
+
+
+def test_alerts_in_one_window_go_out_as_one_digest(smtp_server):
+    handler = Handler()
+    port = smtp_server(handler)
+    alerts = [('Website Down', f'Website https://example{i}.com is down!') for i in range(3)]
+    dispatcher = dispatch(port, alerts, window=0.2)
+    assert dispatcher.sent == 3
+    assert [message['Subject'] for message in handler.messages] == ['3 monitoring alerts']
+    assert handler.messages[0].get_payload().splitlines() == [message for _, message in alerts]
+
+
+def test_refused_digest_is_retried(smtp_server):
+    handler = Handler(refuse=2)
+    port = smtp_server(handler)
+    dispatcher = dispatch(port, [('Website Down', 'Website https://example.com is down!')], window=0, backoff=0.01)
+    assert (dispatcher.sent, dispatcher.failed) == (1, 0)
+    assert [message['Subject'] for message in handler.messages] == ['Website Down']
+
+
+def test_digest_is_given_up_after_the_last_attempt(smtp_server):
+    handler = Handler(refuse=10)
+    port = smtp_server(handler)
+    dispatcher = dispatch(port, [('Website Down', 'Website https://example.com is down!')], window=0, attempts=3,
+                          backoff=0.01)
+    assert (dispatcher.sent, dispatcher.failed) == (0, 1)
+    assert handler.refuse == 7 and handler.messages == []
@@ -0,0 +1,83 @@
+# test_pipeline.py
+'''
+Pipeline stages against a fake PSQL, without RDS or Postgres.
+
+    python -m pytest -q test_pipeline.py
+'''
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pipeline
+from db import PSQL, TableResult
+from rds_new import RDSException
+
+
+class FakePSQL(PSQL):
+    # Two databases; discovering `broken` fails, every table of the others anonymizes fine
+    broken = None
+
+    async def instance_id(self):
+        return 'fake'
+
+    async def get_dbs(self):
+        return ['orders', 'users']
+
+    async def install_anonymizer(self, db):
+        pass
+
+    async def get_tables_for_db(self, db, cache=None):
+        if db == self.broken:
+            raise OSError(f'connection to {db} lost')
+        return ['customers', 'payments']
+
+    async def get_table_sizes(self, db, tables):
+        return {table: (1024, 10) for table in tables}
+
+    async def _run_table(self, db, table, chunk=None):
+        return TableResult(db, table, result=True, duration=0.0)
+
+    async def close(self):
+        pass
+
+
+def run_anonymize(broken, monkeypatch, tmp_path):
+    # The pipeline of a restored and connected instance, from its anonymize stage on
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(FakePSQL, 'broken', broken)
+    monkeypatch.setattr(pipeline, 'PSQL', FakePSQL)
+    reached = []
+
+    async def snapshot():
+        reached.append('snapshot')
+
+    async def destroy():
+        reached.append('destroy')
+
+    run = pipeline.Pipeline(None, None, 'password', 'source', 'target', 'config', state_file=None)
+    run.state.run.update(endpoint='localhost', port=5432, user='postgres', instance='db-FAKE')
+    run.state.timings.update(restore=0.0, connect=0.0)
+    run.snapshot, run.destroy = snapshot, destroy
+    return run, reached
+
+
+def test_failed_discovery_stops_before_the_snapshot(monkeypatch, tmp_path):
+    run, reached = run_anonymize('users', monkeypatch, tmp_path)
+    with pytest.raises(RDSException):
+        asyncio.run(run.run())
+    assert reached == []
+    assert not run.state.done('anonymize')
+    failed = [result for result in run.results if not result.ok]
+    assert [(result.db, result.table) for result in failed] == [('users', None)]
+
+
+def test_anonymized_instance_is_snapshotted(monkeypatch, tmp_path):
+    run, reached = run_anonymize(None, monkeypatch, tmp_path)
+    asyncio.run(run.run())
+    assert reached == ['snapshot', 'destroy']
+    assert len(run.results) == 4 and all(result.ok for result in run.results)
@@ -0,0 +1,123 @@
+# tracing.py
+'''
+Opt-in span timing for the anonymizer, the RDS calls and the site checker.
+
+Nothing is traced unless a Tracer is handed in: PSQL(..., tracer=) and Prober(tracer=)
+take one, instrument_boto() hooks a boto3/aiobotocore client through its event system,
+and RDS(tracer=), AsyncRDS(tracer=) and Waiter(tracer=) trace their waiter polls. With no
+tracer the hooks cost one `if` or a nullcontext each.
+
+Spans are kept in memory as Chrome trace events: save() writes a JSON timeline that
+chrome://tracing or https://ui.perfetto.dev opens, one row per asyncio task, thread or
+database connection. summary() gives the totals per span name.
+
+    tracer = Tracer()
+    async with PSQL(host, password, tracer=tracer) as psql:
+        await psql.anonymize_streamed()
+    tracer.save('anonymize.trace.json')
+'''
+
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.events = []
+        self._origin = clock()
+        self._pid = os.getpid()
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    def _us(self, t):
+        return (t - self._origin) * 1e6
+
+    def lane(self, key=None):
+        # Spans of one task, thread or connection share a row of the timeline
+        if key is None:
+            try:
+                task = asyncio.current_task()
+            except RuntimeError:
+                task = None
+            key = ('task', id(task), task.get_name()) if task else ('thread', threading.get_ident(), threading.current_thread().name)
+        with self._lock:
+            lane = self._lanes.get(key[:2])
+            if lane is None:
+                lane = self._lanes[key[:2]] = len(self._lanes) + 1
+                self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': lane,
+                                    'args': {'name': str(key[2])}})
+        return lane
+
+    def complete(self, name, category, start, end, lane=None, **args):
+        self.events.append({
+            'name': name, 'cat': category, 'ph': 'X', 'pid': self._pid, 'tid': self.lane(lane),
+            'ts': self._us(start), 'dur': (end - start) * 1e6, 'args': args,
+        })
+
+    @contextmanager
+    def span(self, name, category, **args):
+        # Fields the traced code learns along the way can be added to the yielded args
+        start = self.clock()
+        try:
+            yield args
+        except BaseException as e:
+            args['error'] = type(e).__name__
+            raise
+        finally:
+            self.complete(name, category, start, self.clock(), **args)
+
+    def counter(self, name, **values):
+        # A gauge: a stacked area per value in the timeline
+        self.events.append({'name': name, 'ph': 'C', 'pid': self._pid, 'ts': self._us(self.clock()), 'args': values})
+
+    def summary(self):
+        spans = {}
+        for event in self.events:
+            if event['ph'] == 'X':
+                count, total, longest = spans.get(event['name'], (0, 0.0, 0.0))
+                seconds = event['dur'] / 1e6
+                spans[event['name']] = (count + 1, total + seconds, max(longest, seconds))
+        gauges = {}
+        for event in self.events:
+            if event['ph'] == 'C':
+                for key, value in event['args'].items():
+                    name = f"{event['name']}.{key}"
+                    gauges[name] = max(gauges.get(name, value), value)
+        return {
+            'spans': {name: {'count': c, 'total': t, 'max': m} for name, (c, t, m) in sorted(spans.items())},
+            'gauge_max': gauges,
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def instrument_boto(client, tracer: Tracer):
+    # One span per API call, botocore's own retries included, through its event hooks
+    service = client.meta.service_model.service_name
+
+    def before_call(model, context, **kwargs):
+        context['trace_started'] = tracer.clock()
+
+    def after_call(model, context, parsed, **kwargs):
+        started = context.pop('trace_started', None)
+        if started is not None:
+            error = parsed.get('Error', {}).get('Code')
+            args = {'error': error} if error else {}
+            tracer.complete(f'{service}.{model.name}', 'boto', started, tracer.clock(), **args)
+
+    def after_call_error(model, context, exception, **kwargs):
+        started = context.pop('trace_started', None)
+        if started is not None:
+            tracer.complete(f'{service}.{model.name}', 'boto', started, tracer.clock(), error=type(exception).__name__)
+
+    client.meta.events.register(f'before-call.{service}', before_call)
+    client.meta.events.register(f'after-call.{service}', after_call)
+    client.meta.events.register(f'after-call-error.{service}', after_call_error)
+    return client